@@ -2,8 +2,15 @@
 
 from __future__ import annotations
 
+from typing import Iterable, Iterator
+from collections import deque
+from itertools import islice
+
 from image import Image
 from palette import *
+from histogram import histogram, merge, sliding_histograms
+from framepool import map_frames
+from numpy import ndarray, asarray
 import PIL.Image as Pim
 from PIL.Image import NEAREST as N
 from PIL.Image import LANCZOS as L
@@ -17,6 +24,7 @@ LANCZOS = 'l'
 FIRST_FRAME = 'f'
 APPEND      = 'a'
 EVERY       = 'e'
+WINDOW      = 'w'
 
 class Animataion:
     def __init__(self, file: str, location: str = 'inputs', mode: str = 'RGB', source: list = None, duration: int = 100) -> None:
@@ -47,49 +55,25 @@ class Animataion:
 
 
     def read_gif(self) -> tuple[list[Image], int]:
-        frames: list[Image] = []
-        frame_count = 0
 
         # Opens the gif
         gif = Pim.open(f'{self.location}/{self.file}')
 
         # Adds each frame as an Image to the list
-        for frame in Pis.Iterator(gif):
-            frame = frame.convert(self.mode)
-            frames.append(Image(f'{self.file_name}_{frame_count}.png', 'outputs', source = frame))
-            frame_count += 1
+        frames = list(gif_frames(gif, self.file_name, self.mode))
 
-        return frames, frame.info['duration']
+        return frames, gif.info['duration']
     
     def read_mp4(self) -> list[Image]:
-        frames = []
         
         # Captures the video
         capture = cv2.VideoCapture(f'{self.location}/{self.file}')
 
         # Calculates the duration of each frame
-        fps = capture.get(cv2.CAP_PROP_FPS)
-        duration = max(1, int(round(1000 / fps)))
-
-        # Reads the first frame
-        process, source = capture.read()
+        duration = mp4_duration(capture)
 
         # Converts each frame to an Image
-        while process:
-
-            # Converts the data into the correct colour type
-            image_array = cv2.cvtColor(source, cv2.COLOR_BGR2HSV) if self.mode == 'HSV' else cv2.cvtColor(source, cv2.COLOR_BGR2RGB)
-
-            # Creates the image
-            frames.append(Image(
-                self.file,
-                self.location,
-                self.mode,
-                Pim.fromarray(image_array)
-            ))
-
-            # Reads next frame
-            process, source = capture.read()
+        frames = list(mp4_frames(capture, self.file, self.location, self.mode))
 
         return frames, duration
 
@@ -134,22 +118,7 @@ class Animataion:
         )
 
     def save_mp4(self, file_name: str = None, location: str = 'outputs') -> None:
-
-        # Converts frames to RGB
-        frames = [frame.source.convert('RGB') for frame in self.frames]
-
-        # Gets the data format identifier
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v') # Codec, an encoder/decoder
-
-        # Creates the video writer
-        writer = cv2.VideoWriter(f'{location}/{file_name}.mp4', fourcc, 1000 / self.duration, self.frames[0].size)
-
-        # Writes each frame
-        for frame in frames:
-            source = cv2.cvtColor(array(frame), cv2.COLOR_RGB2BGR)
-            writer.write(source)
-
-        writer.release()
+        write_mp4(self.frames, f'{location}/{file_name}.mp4', self.duration, self.frames[0].size)
 
     # Shows the animation
     def show(self, title = None):
@@ -165,23 +134,28 @@ class Animataion:
         
         self.location = location
 
+    # Calls a method of every frame, on `workers` processes, giving
+    # the new frames in order
+    def map(self, method: str, workers: int, *args) -> list[Image]:
+        return map_frames(call_method, self.frames, workers, method, *args)
+
     # Converts image types
-    def convert(self, mode: str) -> Animataion:
+    def convert(self, mode: str, workers: int = 1) -> Animataion:
         return Animataion(
             self.file,
             self.location,
             mode,
-            [frame.convert(mode) for frame in self.frames],
+            self.map('convert', workers, mode),
             self.duration
         )
 
     # Resizes the animation
-    def resize(self, width: int, method: str = NEAREST) -> Animataion:
-        return self.copy([frame.resize(width, method) for frame in self.frames])
+    def resize(self, width: int, method: str = NEAREST, workers: int = 1) -> Animataion:
+        return self.copy(self.map('resize', workers, width, method))
     
     # Applies a filter to each frame
-    def filter(self, filter) -> Animataion:
-        return self.copy([frame.filter(filter) for frame in self.frames])
+    def filter(self, filter, workers: int = 1) -> Animataion:
+        return self.copy(self.map('filter', workers, filter))
 
     # Skips frames and increases duration, making for choppier animation
     def skip(self, step: int) -> Animataion:
@@ -204,48 +178,75 @@ class Animataion:
         return self.palettise(palette)
 
     # Applies a palette to every frame
-    def palettise(self, palette: Palette) -> Animataion:
-        
-        # Gets the flattened palette
-        colours = list(palette.colours.flatten())
+    def palettise(self, palette: Palette, workers: int = 1) -> Animataion:
 
-        # Creates an image containing the palette
-        palette_image = Pim.new('P', (len(colours), 1))
-        palette_image.putpalette(colours)
-
-        # Palettises each frame using the palette image
-        frames = [frame.palettise(palette_image) for frame in self.frames]
-
-        return self.copy(frames)
+        # Palettises each frame. Every frame in a process shares the
+        # palette's lookup table, so each colour is only searched for
+        # once there.
+        return self.copy(self.map('palettise', workers, palette))
     
-    # Creates a custom palette based on each frame
-    def framewise_palettise(self, colours: int, palette_mode: str = DISSIMILAR, alpha: float = 0.5, max_distance = 3) -> Animataion:
-        
-        # Iterates over all frames
-        frames = []
-        for i in range(len(self.frames)):
-
-            # Creates the palette by looking at the frame and its neighbours
-            palette = self.palette(APPEND, i, alpha, max_distance).reduce(colours, palette_mode)
-            frames.append(self.frames[i].palettise(palette))
-
-        return self.copy(frames)
+    # Creates a custom palette based on each frame.
+    # colour_mode is how the colours of the frame's neighbours are
+    # gathered, APPEND or WINDOW. With `temporal`, each frame's palette
+    # is reduced starting from the frame before's, see TemporalReducer.
+    def framewise_palettise(self, colours: int, palette_mode: str = DISSIMILAR, alpha: float = 0.5, max_distance = 3,
+                            workers: int = 1, colour_mode: str = APPEND, temporal: bool = False) -> Animataion:
+
+        # Each reduction needs the one before, so they are done in turn
+        # here, and only the palettising is shared out
+        if temporal:
+            reduce = TemporalReducer(colours, palette_mode)
+            palettes = [
+                reduce(Palette.from_arrays(*counts, self.mode))
+                for counts in self.framewise_histograms(alpha, max_distance, colour_mode)
+            ]
+            return self.copy(map_frames(palettised_frame, self.frames, workers, palettes))
+
+        # Windowed counts are slid along the frames, counting each once,
+        # then every frame's palette is reduced and applied on its own
+        if colour_mode == WINDOW:
+            histograms = list(self.framewise_histograms(alpha, max_distance, colour_mode))
+            return self.copy(map_frames(reduced_frame, self.frames, workers, histograms, self.mode, colours, palette_mode))
+
+        if colour_mode != APPEND:
+            raise ValueError(f'Invalid colour acquisition mode "{colour_mode}"')
+
+        # Every frame's palette is found and applied on its own
+        return self.copy(map_frames(
+            framewise_frame, self.frames, workers,
+            self.file, self.location, self.mode, self.duration, colours, palette_mode, alpha, max_distance,
+            reach = max_distance if max_distance >= 0 else None
+        ))
+
+    # Yields the colours counted for each frame in turn, by APPEND or WINDOW
+    def framewise_histograms(self, alpha: float, max_distance: int, colour_mode: str) -> Iterator[tuple[ndarray, ndarray]]:
+        match colour_mode:
+            case 'a':
+                for i in range(len(self.frames)):
+                    yield self.histogram_append(i, alpha, max_distance)
+            case 'w':
+                if max_distance == -1:
+                    max_distance = len(self.frames)
+                for frame, counts in window_histograms(self.frames, self.width, alpha, max_distance):
+                    yield counts
+            case _:
+                raise ValueError(f'Invalid colour acquisition mode "{colour_mode}"')
             
             
     # Creates pixel art
-    def pixilate(self, width: int, palette: Palette = None) -> Animataion:
+    def pixilate(self, width: int, palette: Palette = None, workers: int = 1) -> Animataion:
 
         anim = self
 
         # Applies the palette to every frame
         if palette:
-            anim = anim.palettise(palette)
+            anim = anim.palettise(palette, workers)
 
         # Downsizes to turn it into, y'know, pixel art
-        anim = anim.resize(width, NEAREST)
+        anim = anim.resize(width, NEAREST, workers)
 
         # Returns to the orignal size
-        anim = anim.resize(self.width, NEAREST)
+        anim = anim.resize(self.width, NEAREST, workers)
 
         return anim
     
@@ -255,6 +256,7 @@ class Animataion:
             case 'f': return self.get_colours_frame(*args)
             case 'a': return self.get_colours_append(*args)
             case 'e': return self.get_colour_every(*args)
+            case 'w': return frequency_pairs(self.histogram_window(*args))
             case _:   raise ValueError(f'Invalid colour acquisition mode "{mode}"')
 
     # Gets colours by looking at a given frame
@@ -262,7 +264,26 @@ class Animataion:
         return self.frames[frame].get_colours()
 
     # Gets colours by adding thinner and thinner slices of temporally
-    # adjacent frames.
+    # adjacent frames, see histogram_append
+    def get_colours_append(self, frame: int = 0,  alpha: float = 0.5, max_distance: int = -1) -> list:
+        return frequency_pairs(self.histogram_append(frame, alpha, max_distance))
+
+    # Gets colour by looking at every frame
+    def get_colour_every(self) -> list:
+        return self.get_colours_append(0, 1, -1)
+
+    # Counts the colours from the animation, as get_colours, giving
+    # an array of colours and an array of their frequencies
+    def histogram(self, mode: str = APPEND, *args) -> tuple[ndarray, ndarray]:
+        match mode:
+            case 'f': return self.frames[args[0] if args else 0].histogram()
+            case 'a': return self.histogram_append(*args)
+            case 'e': return self.histogram_append(0, 1, -1)
+            case 'w': return self.histogram_window(*args)
+            case _:   raise ValueError(f'Invalid colour acquisition mode "{mode}"')
+
+    # Counts the colours of a frame and thinner and thinner slices of
+    # temporally adjacent frames.
     #   frame: the central frame of the process.
     #   alpha: the exponential dropoff as distance to the central frame increases.
     #   max_distance: look no further ahead/behind than the max distance.
@@ -270,70 +291,163 @@ class Animataion:
     #   if alpha is 1, then there is no dropoff.
     #   if alpha is 0, then only consider the central frame
     #   if max_distance is -1, then look over all frames.
-    def get_colours_append(self, frame: int = 0,  alpha: float = 0.5, max_distance: int = -1) -> list:
-        
+    #
+    # Each neighbour is squeezed to alpha ** distance of its width, as
+    # if pasted into a collage beside the central frame, but is counted
+    # on its own and the counts added, so no collage is ever made.
+    def histogram_append(self, frame: int = 0, alpha: float = 0.5, max_distance: int = -1) -> tuple[ndarray, ndarray]:
+
         # Base cases
         if alpha == 0 or max_distance == 0:
-            return self.get_colours_frame(frame)
-
-        # Gets the sources to speed up the process
-        frames = [frame.source for frame in self.frames]
-
-        # Gets the base frame
-        collage = frames[frame].copy()
-        base_width   = collage.width
-        base_height  = collage.height
+            return self.frames[frame].histogram()
 
         # Sets default value
         if max_distance == -1:
             max_distance = len(self.frames)
 
+        base = self.frames[frame]
+        histograms = [base.histogram()]
+
         # Iterates over the set of frames
         for i in range(max(0, frame - max_distance), min(len(self.frames), frame + max_distance)):
 
-            # Calculates the distance, thus the scaling factor
-            d = abs(frame - i)
-            s = alpha ** d
-
-            # Calculates the width
-            swidth = int(base_width * s)
+            # Calculates the distance, thus the scaled width
+            swidth = int(base.width * alpha ** abs(frame - i))
 
-            # Two cases where we should not append the image.
-            #   Don't append the central frame, since we already have that.
+            # Two cases where we should not count the frame.
+            #   Don't count the central frame, since we already have that.
             #   If the scaled with is negligable, just go to the next iteration.
             if i == frame or swidth == 0:
                 continue
 
-            # Scales the image
-            simage = frames[i].resize((swidth, base_height))
+            # Scales the frame, then counts it
+            histograms.append(histogram(asarray(self.frames[i].source.resize((swidth, base.height)))))
 
-            # Creates new image
-            step = Pim.new(self.mode, (collage.width + swidth, base_height))
-            
-            # Pastes the two images in, making a collage
-            step.paste(collage, (0, 0))
-            step.paste(simage,  (collage.width, 0))
+        return merge(histograms)
 
-            # Updates the collage
-            collage = step
+    # Counts the colours of a frame and its neighbours, over the same
+    # frames as histogram_append. Rather than being squeezed, each
+    # neighbour is counted whole, its counts weighted by alpha ** distance,
+    # so that the counts can be slid from frame to frame instead.
+    def histogram_window(self, frame: int = 0, alpha: float = 0.5, max_distance: int = -1) -> tuple[ndarray, ndarray]:
 
-        # Returns the collage's colours
-        return collage.getcolors(collage.width * collage.height)
+        # Sets default value
+        if max_distance == -1:
+            max_distance = len(self.frames)
 
+        # Slides over just the frames needed
+        behind, ahead = window_reach(self.width, alpha, max_distance)
+        start = max(0, frame - behind)
+        frames = self.frames[start:frame + ahead + 1]
+
+        return next(islice(window_histograms(frames, self.width, alpha, max_distance), frame - start, None))[1]
 
-    # Gets colour by making a collage of every frame
-    def get_colour_every(self) -> list:
-        return self.get_colours_append(0, 1, -1)
-    
     # Getters
     def colours(self, mode: str = APPEND, *args) -> ColourList:
-        return ColourList(self.get_colours(mode, *args), self.mode)
+        return ColourList.from_arrays(*self.histogram(mode, *args), self.mode)
     
     def palette(self, mode: str = APPEND, *args) -> Palette:
-        return Palette(self.get_colours(mode, *args), self.mode)
+        return Palette.from_arrays(*self.histogram(mode, *args), self.mode)
+
+
+# Calls a method of the i-th frame, for map_frames
+def call_method(frames: list[Image], i: int, method: str, *args) -> Image:
+    return getattr(frames[i], method)(*args)
+
+# Palettises the i-th frame with a palette made by looking at it and
+# its neighbours, for map_frames. Only the frames within `max_distance`
+# are looked at, which are the same either way.
+def framewise_frame(frames: list[Image], i: int, file: str, location: str, mode: str, duration: int,
+                    colours: int, palette_mode: str, alpha: float, max_distance: int) -> Image:
+    low, high = 0, len(frames)
+    if max_distance >= 0:
+        low, high = max(0, i - max_distance), min(len(frames), i + max(1, max_distance))
+
+    animation = Animataion(file, location, mode, frames[low:high], duration)
+    palette = animation.palette(APPEND, i - low, alpha, max_distance).reduce(colours, palette_mode)
+    return frames[i].palettise(palette)
+
+# Palettises the i-th frame with the i-th of `palettes`, for map_frames
+def palettised_frame(frames: list[Image], i: int, palettes: list[Palette]) -> Image:
+    return frames[i].palettise(palettes[i])
+
+# Palettises the i-th frame with a palette reduced from the i-th of
+# `histograms`, for map_frames
+def reduced_frame(frames: list[Image], i: int, histograms: list[tuple[ndarray, ndarray]], mode: str,
+                  colours: int, palette_mode: str) -> Image:
+    palette = Palette.from_arrays(*histograms[i], mode).reduce(colours, palette_mode)
+    return frames[i].palettise(palette)
+
+# Yields each frame along with its windowed counts, see histogram_window.
+# Frames are read as they are needed, and each is counted once.
+def window_histograms(frames: Iterable[Image], width: int, alpha: float,
+                      max_distance: int) -> Iterator[tuple[Image, tuple[ndarray, ndarray]]]:
+    held = deque()
+
+    def counted() -> Iterator[tuple[ndarray, ndarray]]:
+        for frame in frames:
+            held.append(frame)
+            yield frame.histogram()
 
+    behind, ahead = window_reach(width, alpha, max_distance)
+    for counts in sliding_histograms(counted(), alpha, behind, ahead):
+        yield held.popleft(), counts
 
+# How many frames behind and ahead a window looks. As with
+# histogram_append, that is no more than max_distance behind and one
+# less ahead, and no further than frames would be squeezed to nothing.
+def window_reach(width: int, alpha: float, max_distance: int) -> tuple[int, int]:
+    far = 0
+    while far < max_distance and int(width * alpha ** (far + 1)) > 0:
+        far += 1
 
-        
+    return far, max(0, min(far, max_distance - 1))
+
+# Frequency-colour pairs, as Image.get_colours gives, from counted colours
+def frequency_pairs(histogram: tuple[ndarray, ndarray]) -> list:
+    colours, frequencies = histogram
+    return list(zip(frequencies.tolist(), map(tuple, colours.tolist())))
+
+# Yields each frame of an opened gif as an Image
+def gif_frames(gif: Pim.Image, file_name: str, mode: str = 'RGB') -> Iterator[Image]:
+    for frame_count, frame in enumerate(Pis.Iterator(gif)):
+        yield Image(f'{file_name}_{frame_count}.png', 'outputs', mode, frame.convert(mode))
+
+# Yields each frame of a captured video as an Image
+def mp4_frames(capture: cv2.VideoCapture, file: str, location: str = 'inputs', mode: str = 'RGB') -> Iterator[Image]:
+
+    # Reads the first frame
+    process, source = capture.read()
+
+    while process:
+
+        # Creates the image straight from the frame's array.
+        # Other modes are converted from RGB, as OpenCV's HSV
+        # uses a different range of hues to PIL's.
+        frame = Image.from_array(cv2.cvtColor(source, cv2.COLOR_BGR2RGB), file, location)
+        yield frame if mode == 'RGB' else frame.convert(mode)
+
+        # Reads next frame
+        process, source = capture.read()
+
+    capture.release()
+
+# The duration of each frame of a captured video
+def mp4_duration(capture: cv2.VideoCapture) -> int:
+    return max(1, int(round(1000 / capture.get(cv2.CAP_PROP_FPS))))
+
+# Writes frames to a video as they come, so they need not all be held at once
+def write_mp4(frames: Iterable[Image], path: str, duration: int, size: tuple[int, int]) -> None:
+
+    # Gets the data format identifier
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v') # Codec, an encoder/decoder
+
+    # Creates the video writer
+    writer = cv2.VideoWriter(path, fourcc, 1000 / duration, size)
 
+    # Converts each frame to RGB, then to OpenCV's BGR, and writes it
+    for frame in frames:
+        source = cv2.cvtColor(array(frame.source.convert('RGB')), cv2.COLOR_RGB2BGR)
+        writer.write(source)
 
+    writer.release()
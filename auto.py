@@ -3,17 +3,29 @@
 # command line set of arguments.
 
 from sys import argv
+from os import cpu_count
+from os.path import isdir, isfile, basename, dirname
+from glob import glob
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from image import Image
+from cache import palette_cache
 from visualise import show_colour_wheel, show_3d
 
 # Runs the program.
-#   arg[0]: input file name with extensions
+#   arg[0]: input file name with extensions, or a directory or glob
+#       of files within inputs to process as a batch
 #
 # Optional parameters:
 #   --d: [d]ownscaling algorithm
 #   --w: [w]idth of pixel art image
-#   --p: number of colours in the [p]alette
+#   --c: number of [c]olours in the palette
+#   --p: [p]alette reduction mode, one of Palette.reduce's modes:
+#       k (k-means), s (similar), d (dissimilar), e (extremal),
+#       sd (similar, then dissimilar), q (PIL's quantisation),
+#       m (median cut) or o (octree). m and o are the quickest.
 #   --u: resolution to [u]pscale to
+#   --j: number of processes ([j]obs) for a batch, every core by default
 def auto(args: list, kwargs: dict) -> None:
     
     # Sets defaults and gets optional parameters
@@ -33,10 +45,25 @@ def auto(args: list, kwargs: dict) -> None:
     if 'p' in kwargs:
         palette_mode = kwargs['p']
 
+    workers = cpu_count()
+    if 'j' in kwargs:
+        workers = int(kwargs['j'])
 
-    # Obtains input image and palette
-    image: Image    = Image(args[0])
-    palette = image.palette().reduce(colours, palette_mode)
+
+    # Many files are always processed, never visualised
+    if batched(args[0]):
+        batch(args[0], workers, width, colours, palette_mode)
+    else:
+        process(args[0], 'inputs', mode, width, colours, palette_mode)
+
+
+# Processes or visualises a single file
+def process(file: str, location: str, mode: str, width: int, colours: int, palette_mode: str) -> None:
+
+    # Obtains input image and palette.
+    # Palettes are cached, so rerunning on the same image is quicker.
+    image: Image    = Image(file, location)
+    palette = palette_cache.reduce(image, colours, palette_mode)
 
     match mode:
 
@@ -50,6 +77,51 @@ def auto(args: list, kwargs: dict) -> None:
             show_3d(image, palette)
 
 
+# Whether an argument names many files rather than one
+def batched(path: str) -> bool:
+    return isdir(f'inputs/{path}') or any(c in path for c in '*?[')
+
+# Processes every file in a directory, or matching a glob, inside
+# inputs. The files are shared between `workers` processes, each of
+# which imports NumPy and PIL once and keeps them for every file.
+# Reports how long each file took, and which failed.
+def batch(pattern: str, workers: int, width: int, colours: int, palette_mode: str) -> None:
+    files = find_files(pattern)
+    failures = []
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {
+            pool.submit(timed_process, file, width, colours, palette_mode): file
+                for file in files
+        }
+
+        for future in as_completed(futures):
+            file = futures[future]
+            try:
+                print(f'{file}\t{future.result():.3f} s')
+            except Exception as error:
+                failures.append(file)
+                print(f'{file}\tfailed: {error!r}')
+
+    print(f'\n{len(files) - len(failures)} of {len(files)} files processed.')
+    for file in failures:
+        print(f'\tfailed: {file}')
+
+# Processes a file, returning how many seconds it took
+def timed_process(path: str, width: int, colours: int, palette_mode: str) -> float:
+    start = perf_counter()
+    process(basename(path), dirname(path), 'p', width, colours, palette_mode)
+    return perf_counter() - start
+
+# Finds the files of a batch, skipping hidden files such as .gitignore
+def find_files(pattern: str) -> list[str]:
+    path = f'inputs/{pattern}'
+    if isdir(path):
+        path = f'{path}/*'
+
+    return sorted(file for file in glob(path) if isfile(file) and not basename(file).startswith('.'))
+
+
 # Reads argv as a list, grabbing arguments
 # and key-word arguments.
 def read_arguments(args: list) -> tuple[list, dict]:
@@ -0,0 +1,238 @@
+# Keeps reduced palettes on disk, so that an image seen before does
+# not need its palette found again. Also reads and writes palettes in
+# GIMP's .gpl and Adobe's .act formats. Only .pal and .gpl keep the
+# colours' frequencies, so the cache keeps its palettes as .pal.
+
+from __future__ import annotations
+
+from hashlib import sha1
+from os import listdir, remove, replace, utime, getpid
+from os.path import basename, getsize, getmtime, splitext
+from struct import pack, unpack, calcsize, error as StructError
+
+from numpy import asarray, frombuffer, zeros, ones, int64, uint8
+
+from palette import Palette
+
+# The cache's own format:
+#   magic, version, length of the mode name, the mode name,
+#   number of colours, then the colours as bytes and the frequencies
+#   as little-endian 64-bit ints.
+MAGIC   = b'PXPL'
+VERSION = 1
+HEADER  = '<4sBB'
+COUNT   = '<I'
+
+# Hashed into every cache key. Bumped whenever a reduction would give
+# different colours, so palettes cached before are not found again.
+CACHE_VERSION = 2
+
+# ACT files always hold 256 colours, optionally followed by how many
+# are used and which is transparent
+ACT_COLOURS = 256
+
+
+# Writes a palette, the format chosen by the file's extension unless
+# given. .gpl and .act only hold RGB, so other modes are converted.
+# .act holds no frequencies either, so a palette read back from it
+# weighs every colour the same, and reduces differently.
+def write_palette(palette: Palette, path: str, format: str = None) -> None:
+    match '.' + format if format else splitext(path)[1].lower():
+        case '.pal':    data = pal_bytes(palette)
+        case '.gpl':    data = gpl_bytes(palette, splitext(basename(path))[0])
+        case '.act':    data = act_bytes(palette)
+        case extension: raise ValueError(f'No such palette format as "{extension}"')
+
+    with open(path, 'wb') as f:
+        f.write(data)
+
+# Reads a palette, the format chosen by the file's extension.
+# .gpl and .act palettes are RGB, and converted to `mode`.
+def read_palette(path: str, mode: str = 'RGB') -> Palette:
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    match splitext(path)[1].lower():
+        case '.pal':    return pal_palette(data)
+        case '.gpl':    palette = gpl_palette(data)
+        case '.act':    palette = act_palette(data)
+        case extension: raise ValueError(f'No such palette format as "{extension}"')
+
+    if mode != 'RGB':
+        palette = palette.convert(mode)
+    return palette
+
+
+def pal_bytes(palette: Palette) -> bytes:
+    mode = palette.mode.encode('ascii')
+    return b''.join([
+        pack(HEADER, MAGIC, VERSION, len(mode)),
+        mode,
+        pack(COUNT, len(palette)),
+        palette.colours.astype(uint8).tobytes(),
+        palette.frequencies.astype('<i8').tobytes(),
+    ])
+
+def pal_palette(data: bytes) -> Palette:
+    magic, version, length = unpack(HEADER, data[:calcsize(HEADER)])
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a palette file, or from another version')
+
+    start = calcsize(HEADER)
+    mode = data[start:start + length].decode('ascii')
+    start += length
+
+    count, = unpack(COUNT, data[start:start + calcsize(COUNT)])
+    start += calcsize(COUNT)
+
+    colours = frombuffer(data, dtype = uint8, count = 3 * count, offset = start).reshape(count, 3)
+    frequencies = frombuffer(data, dtype = '<i8', count = count, offset = start + 3 * count)
+
+    return Palette.from_arrays(colours.copy(), frequencies.astype(int64), mode)
+
+
+# GIMP palettes are text, a colour per line. The frequency is written
+# as the colour's name, and read back if the name is a number.
+def gpl_bytes(palette: Palette, name: str) -> bytes:
+    palette = palette if palette.mode == 'RGB' else palette.convert('RGB')
+
+    lines = ['GIMP Palette', f'Name: {name}', 'Columns: 0', '#']
+    for (r, g, b), frequency in zip(palette.colours.tolist(), palette.frequencies.tolist()):
+        lines.append(f'{r:3} {g:3} {b:3}\t{frequency}')
+
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+def gpl_palette(data: bytes) -> Palette:
+    lines = data.decode('utf-8').splitlines()
+    if not lines or lines[0].strip() != 'GIMP Palette':
+        raise ValueError('Not a GIMP palette')
+
+    colours = []
+    for line in lines[1:]:
+        parts = line.split()
+
+        # Skips the header fields, comments and blank lines
+        if len(parts) < 3 or not all(part.isdigit() for part in parts[:3]):
+            continue
+
+        frequency = int(parts[3]) if len(parts) > 3 and parts[3].isdigit() else 1
+        colours.append((frequency, tuple(int(part) for part in parts[:3])))
+
+    return Palette(colours)
+
+
+# Adobe colour tables hold no frequencies, so every colour reads
+# back with a frequency of 1
+def act_bytes(palette: Palette) -> bytes:
+    palette = palette if palette.mode == 'RGB' else palette.convert('RGB')
+    if len(palette) > ACT_COLOURS:
+        raise ValueError(f'ACT files hold at most {ACT_COLOURS} colours')
+
+    table = zeros((ACT_COLOURS, 3), dtype = uint8)
+    table[:len(palette)] = palette.colours
+
+    return table.tobytes() + pack('>HH', len(palette), 0xFFFF)
+
+def act_palette(data: bytes) -> Palette:
+    count = ACT_COLOURS
+    if len(data) >= 3 * ACT_COLOURS + 4:
+        count, transparent = unpack('>HH', data[3 * ACT_COLOURS:3 * ACT_COLOURS + 4])
+
+    colours = frombuffer(data, dtype = uint8, count = 3 * count).reshape(count, 3)
+    return Palette.from_arrays(colours.copy(), ones(count, dtype = int64))
+
+
+class PaletteCache:
+    # Cached palettes are kept in `location` as <key>.pal files. Once
+    # they take up more than `limit` bytes, the least recently used
+    # are removed. Reading a palette counts as using it.
+    def __init__(self, location: str = 'palettes', limit: int = 2 ** 24) -> None:
+        self.location   = location
+        self.limit      = limit
+
+    # A key for an image's pixels and the reduction's parameters.
+    # The image's file name is not part of it, so the same picture
+    # under another name, or resized to another width afterwards,
+    # still finds its palette. An image read from a file is keyed by
+    # the file's bytes, so finding its palette does not decode it, and
+    # a large JPEG can still be decoded small when it is resized.
+    def key(self, image, *parameters) -> str:
+        digest = sha1()
+        digest.update(f'{CACHE_VERSION} {image.mode} {image.size} {parameters!r}'.encode('utf-8'))
+
+        if image.format:
+            with open(f'{image.location}/{image.file}', 'rb') as f:
+                digest.update(f.read())
+        else:
+            digest.update(asarray(image.source).tobytes())
+
+        return digest.hexdigest()
+
+    # Reduces an image's palette, or reads it if it was reduced before
+    def reduce(self, image, size: int = 8, mode: str = 's', *args) -> Palette:
+        key = self.key(image, size, mode, *args)
+
+        palette = self.get(key)
+        if palette is None:
+            palette = image.palette().reduce(size, mode, *args)
+            self.put(key, palette)
+
+        return palette
+
+    def get(self, key: str) -> Palette:
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                palette = pal_palette(f.read())
+        except (OSError, ValueError, StructError):
+            return None
+
+        # Marks it as recently used
+        utime(path)
+        return palette
+
+    # Writes to a temporary file first, so that other processes never
+    # read a palette that is half written
+    def put(self, key: str, palette: Palette) -> None:
+        temporary = f'{self.location}/{key}.{getpid()}.tmp'
+        write_palette(palette, temporary, 'pal')
+        replace(temporary, self.path(key))
+        self.evict()
+
+    # Removes the least recently used palettes until the cache fits.
+    # Other processes may be evicting at the same time, so files that
+    # have already gone are skipped.
+    def evict(self) -> None:
+        files = []
+        for file in listdir(self.location):
+            if self.cached(file):
+                try:
+                    path = self.path(splitext(file)[0])
+                    files.append((getmtime(path), getsize(path), path))
+                except OSError:
+                    continue
+        files.sort()
+
+        total = sum(size for time, size, path in files)
+        for time, size, path in files:
+            if total <= self.limit:
+                break
+
+            total -= size
+            try:
+                remove(path)
+            except OSError:
+                pass
+
+    def path(self, key: str) -> str:
+        return f'{self.location}/{key}.pal'
+
+    # Whether a file is one of the cache's own, rather than a palette
+    # someone has put in the same directory
+    def cached(self, file: str) -> bool:
+        key, extension = splitext(file)
+        return extension == '.pal' and len(key) == 40 and all(c in '0123456789abcdef' for c in key)
+
+
+# Globally accessible
+palette_cache = PaletteCache()
@@ -2,25 +2,63 @@
 
 from __future__ import annotations
 
-from numpy import array, ndarray, average, round
-from colorsys import hsv_to_rgb, rgb_to_hsv
+from numpy import array, ndarray, empty, arange, argsort, average, round, absolute, minimum, int64, uint8
+from numpy import maximum, clip, where, select, stack, float64
 
+# A list of colours and how often each occurs.
+# Colours are kept in an N x 3 array of bytes and frequencies in an
+# array of 64-bit ints. Both arrays have spare room at the end, so
+# appending is amortised, and slicing gives a view that shares them.
 class ColourList:
-    def __init__(self, image_colours: list, mode: str = 'RGB') -> None:
+    __slots__ = ('buffer', 'counts', 'length', 'mode', 'pairs')
 
-        # We have to do some slight acrobatics here in order to
-        # get the colours themselves into a numpy array. If we
-        # place the colour arrays directly into data, then because
-        # the datatype would be (int, ndarray), it defaults to object
-        # and stores the ndarray as a generic object, losing all
-        # the advantages of using an array.
-        image_colours       = array(image_colours, dtype = object)
+    # Takes a list of frequency-colour pairs, with colours as stored,
+    # as `data` and Image.get_colours give them. PIL's getcolors gives
+    # LAB pairs offset instead, see `ordered`.
+    def __init__(self, image_colours: list = (), mode: str = 'RGB') -> None:
+        frequencies = array([colour[0] for colour in image_colours], dtype = int64)
+        colours     = triples(array([colour[1] for colour in image_colours], dtype = uint8))
 
-        self.data           = image_colours
-        self.colours        = array([array(colour[1]) for colour in image_colours])
-        self.frequencies    = image_colours[:, 0]
+        self.set_arrays(colours.reshape(-1, 3), frequencies, mode)
 
-        self.mode = mode
+    # Makes a list straight from arrays of colours and frequencies.
+    # The arrays are used as they are, not copied.
+    @classmethod
+    def from_arrays(cls, colours: ndarray, frequencies: ndarray, mode: str = 'RGB') -> ColourList:
+        colour_list = cls.__new__(cls)
+        colour_list.set_arrays(colours, frequencies, mode)
+        return colour_list
+
+    def set_arrays(self, colours: ndarray, frequencies: ndarray, mode: str) -> None:
+        self.buffer = colours.astype(uint8, copy = False)
+        self.counts = frequencies.astype(int64, copy = False)
+        self.length = len(colours)
+        self.mode   = mode
+        self.changed()
+
+    # Called whenever the colours change, to drop anything derived from them
+    def changed(self) -> None:
+        self.pairs = None
+
+    # The colours and their frequencies, without the spare room
+    @property
+    def colours(self) -> ndarray:
+        return self.buffer[:self.length]
+
+    @property
+    def frequencies(self) -> ndarray:
+        return self.counts[:self.length]
+
+    # The colours as an array of frequency-colour pairs.
+    # This is slow to build, so is only made when asked for.
+    @property
+    def data(self) -> ndarray:
+        if self.pairs is None:
+            self.pairs = empty((len(self), 2), dtype = object)
+            for i, (frequency, colour) in enumerate(zip(self.frequencies.tolist(), self.colours.tolist())):
+                self.pairs[i, 0] = frequency
+                self.pairs[i, 1] = tuple(colour)
+        return self.pairs
 
     # Returns colour data
     def __call__(self) -> ndarray:
@@ -28,135 +66,297 @@ class ColourList:
     
     # Other magic methods
     def __len__(self) -> int:
-        return len(self.colours)
+        return self.length
     
+    # Indexing gives a frequency-colour pair.
+    # Slicing gives a list that shares this list's arrays, and
+    # indexing with an array gives a list of those colours.
     def __getitem__(self, index) -> tuple:
-        return self.data[index]
+        if isinstance(index, (slice, ndarray)):
+            return self.from_arrays(self.colours[index], self.frequencies[index], self.mode)
+        return (int(self.frequencies[index]), tuple(self.colours[index].tolist()))
+
+    # Sorts by frequency, keeping the order of equal frequencies.
+    # Reversing still keeps equal frequencies in order, as sorted() does.
+    def by_frequency(self, reverse: bool = False) -> ColourList:
+        keys = -self.frequencies if reverse else self.frequencies
+        return self[argsort(keys, kind = 'stable')]
+
+    # Makes a copy that does not share arrays with this list
+    def copy(self) -> ColourList:
+        return self.from_arrays(self.colours.copy(), self.frequencies.copy(), self.mode)
+
+    # A copy with its colours as given by `ordered`, such as for PIL's
+    # pixel access. Ordering the copy again gives back the original.
+    def ordered(self) -> ColourList:
+        return self.from_arrays(ordered(self.colours, self.mode), self.frequencies.copy(), self.mode)
+
+    # Appends a frequency-colour pair to the list, in place.
+    # When full, the arrays double in size.
+    def append(self, colour: tuple) -> None:
+        if self.length == len(self.buffer):
+            self.reserve(max(8, 2 * self.length))
+
+        self.buffer[self.length] = triples(array([colour[1]], dtype = uint8))[0]
+        self.counts[self.length] = colour[0]
+        self.length += 1
+        self.changed()
+
+    # Makes room for at least `capacity` colours
+    def reserve(self, capacity: int) -> None:
+        if capacity <= len(self.buffer):
+            return
+
+        buffer = empty((capacity, 3), dtype = uint8)
+        counts = empty(capacity, dtype = int64)
+        buffer[:self.length] = self.colours
+        counts[:self.length] = self.frequencies
+
+        self.buffer, self.counts = buffer, counts
     
-    # Add a colour to the list.
-    # This is not a fast operation due to numpy array modification.
+    # Add a colour to the list, returning a new list
     def add(self, colour: tuple) -> ColourList:
-        colours = list(self.data)
+        colours = self.copy()
         colours.append(colour)
-        return ColourList(colours, self.mode)
+        return colours
     
-    # Converts colours to a different mode
+    # Converts colours to a different mode, all at once
     def convert(self, mode: str) -> ColourList:
-        if self.mode == mode:
-            return ColourList(self.data, mode)
-        
-
-        # Converts each item to RGB/HSV appropriately.
-        # Has to transform from 0-255 to 0-1 amd back up to 0-255.
-        # Plus, it has to be an int at the end.
-        # The colour array is transformed separately to packing it
-        # with frequency because otherwise the data would be in an
-        # array of data-type "object", preventing correct casting.
-        if self.mode == 'RGB' and mode == 'HSV':
-            
-            # Transforms colour
-            hsv = array(round(
-                255 * array(
-                    [rgb_to_hsv(*(self.colours[i] / 255)) for i in range(len(self.data))]
-                )
-            ), dtype=int)            
-
-            return ColourList(
-                [( # Packs frequency and colour together
-                    self.frequencies[i],
-                    hsv[i]
-                ) for i in range(len(self.data))],
-                mode = mode
-            )
-
-
-        if self.mode == 'HSV' and mode == 'RGB':
-            
-            # Transforms colour
-            rgb = array(round(
-                255 * array(
-                    [hsv_to_rgb(*(self.colours[i] / 255)) for i in range(len(self.data))]
-                )
-            ), dtype=int)
-
-            return ColourList(
-                [( # Packs frequency and colour together
-                    self.frequencies[i],
-                    rgb[i]
-                ) for i in range(len(self.data))],
-                mode = mode
-            )
-
-        raise ValueError(f'Cannot convert from mode "{self.mode}" to "{mode}".')
+        return self.from_arrays(convert_colours(self.colours, self.mode, mode), self.frequencies, mode)
     
     # Given a tuple of colour, returns the most similar
     # that exists in the ColourList
     def similar(self, colour: tuple) -> tuple:
-        return min(self.colours, key = lambda c: sum([
-                (c[0] - colour[0]) ** 2,
-                (c[1] - colour[1]) ** 2,
-                (c[2] - colour[2]) ** 2
-            ])
-        )
+        return self.colours[nearest_colours(array([colour]), self.colours, 'RGB')[0][0]]
     
     # Returns a dissimilarity score of the colour to the palette
     def similarity(self, colour: tuple) -> float:
-        return min([sum([
-                (c[0] - colour[0]) ** 2,
-                (c[1] - colour[1]) ** 2,
-                (c[2] - colour[2]) ** 2
-            ]) for c in self.colours]
-        )
+        return nearest_colours(array([colour]), self.colours, 'RGB')[1][0]
+
+# Colour space conversions.
+# These work on whole arrays of colours, any shape ending in 3.
+# Colours are stored as bytes, 0-255. LAB is packed the same way
+# as PIL's LAB mode: L scaled from 0-100, and a and b as two's
+# complement bytes.
+CONVERSIONS = {
+    ('RGB', 'HSV'): lambda c: hsv_bytes(rgb_to_hsv_unit(c / 255)),
+    ('HSV', 'RGB'): lambda c: rgb_bytes(hsv_to_rgb_unit(c / 255)),
+    ('RGB', 'LAB'): lambda c: lab_bytes(rgb_to_lab(c / 255)),
+    ('LAB', 'RGB'): lambda c: rgb_bytes(lab_to_rgb(lab_floats(c))),
+    ('HSV', 'LAB'): lambda c: lab_bytes(rgb_to_lab(hsv_to_rgb_unit(c / 255))),
+    ('LAB', 'HSV'): lambda c: hsv_bytes(rgb_to_hsv_unit(lab_to_rgb(lab_floats(c)))),
+}
+
+# Converts an array of byte colours from one mode to another
+def convert_colours(colours: ndarray, mode: str, to: str) -> ndarray:
+    if mode == to:
+        return colours
+    if (mode, to) not in CONVERSIONS:
+        raise ValueError(f'Cannot convert from mode "{mode}" to "{to}".')
+    return CONVERSIONS[mode, to](colours)
+
+# Scales 0-1 colours to bytes, rounding as ColourList always has
+def rgb_bytes(colours: ndarray) -> ndarray:
+    return round(255 * colours).astype(uint8)
+
+hsv_bytes = rgb_bytes
+
+# Vectorised colorsys.rgb_to_hsv, working in 0-1.
+# Follows colorsys step by step so the results are identical.
+def rgb_to_hsv_unit(colours: ndarray) -> ndarray:
+    r, g, b = colours[..., 0], colours[..., 1], colours[..., 2]
+
+    maxc = maximum(maximum(r, g), b)
+    minc = minimum(minimum(r, g), b)
+    rangec = maxc - minc
+    grey = rangec == 0
+
+    # Avoids dividing by zero for greys, which are set after
+    rangec = where(grey, 1.0, rangec)
+    s = rangec / where(maxc == 0, 1.0, maxc)
+    rc = (maxc - r) / rangec
+    gc = (maxc - g) / rangec
+    bc = (maxc - b) / rangec
+
+    h = select([r == maxc, g == maxc], [bc - gc, 2.0 + rc - bc], 4.0 + gc - rc)
+    h = (h / 6.0) % 1.0
+
+    return stack([where(grey, 0.0, h), where(grey, 0.0, s), maxc], axis = -1)
+
+# Vectorised colorsys.hsv_to_rgb, working in 0-1
+def hsv_to_rgb_unit(colours: ndarray) -> ndarray:
+    h, s, v = colours[..., 0], colours[..., 1], colours[..., 2]
+
+    i = (h * 6.0).astype(int64)
+    f = (h * 6.0) - i
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    i = i % 6
+
+    sectors = [i == n for n in range(6)]
+    r = select(sectors, [v, q, p, p, t, v])
+    g = select(sectors, [t, v, v, q, p, p])
+    b = select(sectors, [p, p, t, v, v, q])
+
+    # Greys are returned as they are
+    grey = s == 0.0
+    return stack([where(grey, v, r), where(grey, v, g), where(grey, v, b)], axis = -1)
+
+# sRGB to CIELAB, under a D65 white point.
+# Takes 0-1 RGB and gives L in 0-100 and a, b around 0.
+def rgb_to_lab(colours: ndarray) -> ndarray:
+    linear = where(colours <= 0.04045, colours / 12.92, ((colours + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ RGB_TO_XYZ.T / WHITE
+
+    f = where(xyz > LAB_EPSILON, xyz ** (1 / 3), xyz / (3 * LAB_DELTA ** 2) + 4 / 29)
+    return stack([
+        116 * f[..., 1] - 16,
+        500 * (f[..., 0] - f[..., 1]),
+        200 * (f[..., 1] - f[..., 2]),
+    ], axis = -1)
+
+# CIELAB back to 0-1 sRGB
+def lab_to_rgb(colours: ndarray) -> ndarray:
+    fy = (colours[..., 0] + 16) / 116
+    f = stack([fy + colours[..., 1] / 500, fy, fy - colours[..., 2] / 200], axis = -1)
+
+    xyz = where(f > LAB_DELTA, f ** 3, 3 * LAB_DELTA ** 2 * (f - 4 / 29)) * WHITE
+    linear = clip(xyz @ XYZ_TO_RGB.T, 0, 1)
+
+    return where(linear <= 0.0031308, linear * 12.92, 1.055 * linear ** (1 / 2.4) - 0.055)
+
+# Packs CIELAB into bytes, and unpacks it again
+def lab_bytes(colours: ndarray) -> ndarray:
+    return ordered(clip(round(colours * LAB_SCALE + LAB_OFFSET), 0, 255).astype(uint8), 'LAB')
+
+def lab_floats(colours: ndarray) -> ndarray:
+    return (ordered(colours, 'LAB') - LAB_OFFSET) / LAB_SCALE
+
+# PIL stores LAB's a and b as two's complement bytes, but its pixel
+# access, such as getcolors and putpixel, gives them offset by 128.
+# Flipping their top bit turns one into the other. Offset bytes rise
+# with the value, so colours are measured and averaged as these.
+# Other modes are already in order. Takes an array of integers.
+def ordered(colours: ndarray, mode: str) -> ndarray:
+    if mode != 'LAB':
+        return colours
+    return colours ^ LAB_SIGN.astype(colours.dtype)
+
+RGB_TO_XYZ = array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+])
+XYZ_TO_RGB = array([
+    [ 3.2404542, -1.5371385, -0.4985314],
+    [-0.9692660,  1.8760108,  0.0415560],
+    [ 0.0556434, -0.2040259,  1.0572252],
+])
+WHITE       = array([0.95047, 1.0, 1.08883])
+LAB_DELTA   = 6 / 29
+LAB_EPSILON = LAB_DELTA ** 3
+LAB_SCALE   = array([255 / 100, 1, 1])
+LAB_OFFSET  = array([0, 128, 128])
+LAB_SIGN    = array([0, 128, 128], dtype = uint8)
+
+
+# Gives an array of colours three channels.
+# Grey colours, as from PIL's getcolors, are a single value.
+def triples(colours: ndarray) -> ndarray:
+    if colours.ndim == 1:
+        return colours[:, None].repeat(3, axis = 1)
+    return colours
 
 # Averages colours
 def average_colour(colours: ColourList) -> tuple:
-    if colours.mode == 'L':
-        return [
-            sum(colours.frequencies),
-            int(round(average(colours.colours, weights = colours.frequencies)))
-        ]
-
+    points = ordered(colours.colours, colours.mode)
     return [
         # Frequency is summed as the new colour would represent
         # a larger portion of the image
         sum(colours.frequencies),
-        ( # Averages each channel
-            int(round(average(colours.colours[:, 0], weights = colours.frequencies))),
-            int(round(average(colours.colours[:, 1], weights = colours.frequencies))),
-            int(round(average(colours.colours[:, 2], weights = colours.frequencies))),
-        )
+        tuple(ordered(array([ # Averages each channel
+            int(round(average(points[:, 0], weights = colours.frequencies))),
+            int(round(average(points[:, 1], weights = colours.frequencies))),
+            int(round(average(points[:, 2], weights = colours.frequencies))),
+        ]), colours.mode).tolist())
     ]
 
-# Finds the difference between a pair of colours
+# Finds the difference between a pair of frequency-colour pairs.
+# These are thin wrappers over the array versions below.
 def colour_difference(a: tuple, b: tuple, mode: str) -> float:
     match mode:
         case 'RGB': return colour_difference_RGB(a, b)
         case 'HSV': return colour_difference_HSV(a, b)
         case 'L':   return colour_difference_L(a, b)
+        case 'LAB': return colour_difference_LAB(a, b)
         case _:     raise ValueError(f'Invalid colour mode "{mode}"')
 
 def colour_difference_RGB(a: tuple, b: tuple) -> float:
-    return sum([
-        (a[1][0] - b[1][0]) ** 2,
-        (a[1][1] - b[1][1]) ** 2,
-        (a[1][2] - b[1][2]) ** 2
-    ])
+    return colour_differences(array(a[1]), array(b[1]), 'RGB').item()
 
 def colour_difference_HSV(a: tuple, b: tuple) -> float:
-    return sum([
-        (min( # Hue is circular
-            abs(a[1][0] - b[1][0]), 
-            255 - abs(a[1][0] - b[1][0])
-        ) * 2) ** 2,
-        (a[1][1] - b[1][1]) ** 2,
-        (a[1][2] - b[1][2]) ** 2
-    ])
+    return colour_differences(array(a[1]), array(b[1]), 'HSV').item()
 
 def colour_difference_H(a: tuple, b: tuple) -> float:
-    return min( # Hue is circular
-            abs(a[1][0] - b[1][0]), 
-            255 - abs(a[1][0] - b[1][0])
-        )
+    return hue_differences(array(a[1][0]), array(b[1][0])).item()
 
 def colour_difference_L(a: tuple, b: tuple) -> float:
-    return (a[0] - b[0]) ** 2
+    return colour_differences(array(a[1]), array(b[1]), 'L').item()
+
+def colour_difference_LAB(a: tuple, b: tuple) -> float:
+    return colour_differences(ordered(array(a[1]), 'LAB'), ordered(array(b[1]), 'LAB'), 'LAB').item()
+
+
+# Finds the squared differences between arrays of colours at once.
+# The arrays broadcast against each other, so a column of colours
+# against a row gives every pairwise difference.
+#   'RGB':  distance in RGB
+#   'HSV':  as RGB, but hue is circular and counts double
+#   'L':    difference in lightness, the first channel
+#   'LAB':  CIE76 delta E, for colours as given by `ordered`
+# Integer colours give exact integer differences.
+def colour_differences(a: ndarray, b: ndarray, mode: str) -> ndarray:
+    integers = a.dtype.kind in 'iub' and b.dtype.kind in 'iub'
+    difference = a.astype(int64 if integers else float64) - b.astype(int64 if integers else float64)
+
+    match mode:
+        case 'RGB':
+            pass
+        case 'HSV':
+            difference[..., 0] = hue_differences(a[..., 0], b[..., 0]) * 2
+        case 'L':
+            return difference[..., 0] ** 2
+        case 'LAB':
+            difference = difference / LAB_SCALE
+        case _:
+            raise ValueError(f'Invalid colour mode "{mode}"')
+
+    difference **= 2
+    return difference[..., 0] + difference[..., 1] + difference[..., 2]
+
+# Hue difference, going whichever way round the circle is shorter
+def hue_differences(a: ndarray, b: ndarray) -> ndarray:
+    integers = a.dtype.kind in 'iub' and b.dtype.kind in 'iub'
+    hue = absolute(a.astype(int64 if integers else float64) - b)
+    return minimum(hue, 255 - hue)
+
+# Every difference between two lists of colours, as an N x M matrix
+def distance_matrix(a: ndarray, b: ndarray, mode: str) -> ndarray:
+    return colour_differences(a[:, None], b[None, :], mode)
+
+# For each colour in `a`, the index of the nearest colour in `b` and
+# the difference to it. The first of equally near colours is picked.
+# Works through `a` in chunks so that no more than about `budget`
+# differences are held at once.
+def nearest_colours(a: ndarray, b: ndarray, mode: str, budget: int = 2 ** 20) -> tuple[ndarray, ndarray]:
+    indices = empty(len(a), dtype = int64)
+    differences = empty(len(a), dtype = float64 if mode == 'LAB' else int64)
+
+    step = max(1, budget // max(1, len(b)))
+    for start in range(0, len(a), step):
+        matrix = distance_matrix(a[start:start + step], b, mode)
+        indices[start:start + step] = matrix.argmin(axis = 1)
+        differences[start:start + step] = matrix[arange(len(matrix)), indices[start:start + step]]
+
+    return indices, differences
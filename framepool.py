@@ -0,0 +1,119 @@
+# Runs per-frame work on a pool of processes. Frames go to and from
+# the workers through shared memory rather than being pickled.
+
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+from numpy import ndarray, prod, uint8
+
+from image import Image
+
+# How many chunks of frames each worker gets, so that one slow chunk
+# does not leave the others idle
+CHUNKS_PER_WORKER = 4
+
+# Roughly how many bytes of frames, in and out, are shared with the
+# workers at once
+BATCH_BUDGET = 2 ** 25
+
+
+# Applies `task` to every frame on `workers` processes, in order.
+# `task(frames, i, *args)` makes the new i-th frame, and may look at
+# the frames up to `reach` either side of it, or all of them if
+# `reach` is None. In a worker, frames out of reach are None. The task
+# must be a module level function, so that the workers can find it.
+# Frames are sent in batches of about BATCH_BUDGET bytes, along with
+# the frames within reach of them, through shared memory that is
+# reused from batch to batch. Looking at every frame sends them all.
+def map_frames(task, frames: list[Image], workers: int, *args, reach: int = 0) -> list[Image]:
+
+    # The first frame is done here, which gives the shape of the rest
+    first = task(frames, 0, *args)
+    if len(frames) == 1 or workers <= 1:
+        return [first] + [task(frames, i, *args) for i in range(1, len(frames))]
+
+    shape, output_shape = frames[0].array.shape, first.array.shape
+    if reach is None:
+        size = reach = len(frames)
+    else:
+        size = max(workers, BATCH_BUDGET // (int(prod(shape)) + int(prod(output_shape))))
+
+    # Enough room for a batch and the frames within reach either side
+    capacity = min(len(frames), size + 2 * reach)
+    inputs, outputs = shared((capacity,) + shape), shared((size,) + output_shape)
+    pixels = results = None
+
+    try:
+        pixels, results = buffer(inputs, capacity, shape), buffer(outputs, size, output_shape)
+        output = [first]
+
+        # Each worker is sent the task once, and keeps it for every
+        # chunk, so a palette's lookup table is built once per process
+        names = [(frame.file, frame.location) for frame in frames]
+        setup = (task, inputs.name, outputs.name, names, frames[0].mode, shape, output_shape, capacity, size, args)
+        with ProcessPoolExecutor(workers, initializer = start_worker, initargs = setup) as pool:
+            for start in range(1, len(frames), size):
+                end = min(len(frames), start + size)
+                low, high = max(0, start - reach), min(len(frames), end + reach)
+
+                for i in range(low, high):
+                    pixels[i - low] = frames[i].array
+
+                # Workers write their results straight to their place,
+                # so the order is kept
+                list(pool.map(run_frames, [
+                    (low, high, start, chunk) for chunk in chunks(start, end, workers * CHUNKS_PER_WORKER)
+                ]))
+
+                output += [
+                    Image.from_array(results[i - start].copy(), *names[i], first.mode)
+                    for i in range(start, end)
+                ]
+
+        return output
+
+    # Memory can only be closed once nothing here views it
+    finally:
+        pixels = results = None
+        for memory in (inputs, outputs):
+            memory.close()
+            memory.unlink()
+
+# The task a worker was started with, see start_worker
+job: tuple = None
+
+# Keeps the task and opens the shared memory, once per worker
+def start_worker(task, inputs: str, outputs: str, names: list[tuple[str, str]], mode: str,
+                 shape: tuple, output_shape: tuple, capacity: int, size: int, args: tuple) -> None:
+    global job
+    inputs, outputs = SharedMemory(inputs), SharedMemory(outputs)
+    job = (task, buffer(inputs, capacity, shape), buffer(outputs, size, output_shape), names, mode, args, (inputs, outputs))
+
+# Makes frames `start` to `end` of the batch that begins at
+# `batch_start`, in a worker. Frames `low` to `high` are in the input.
+def run_frames(part: tuple[int, int, int, tuple[int, int]]) -> None:
+    task, pixels, results, names, mode, args, memory = job
+    low, high, batch_start, (start, end) = part
+
+    frames = [None] * len(names)
+    for i in range(low, high):
+        frames[i] = Image.from_array(pixels[i - low], *names[i], mode)
+
+    for i in range(start, end):
+        results[i - batch_start] = task(frames, i, *args).array
+
+
+# Shared memory for `shape` bytes
+def shared(shape: tuple) -> SharedMemory:
+    return SharedMemory(create = True, size = max(1, int(prod(shape))))
+
+# Shared memory as `count` frames of `shape`
+def buffer(memory: SharedMemory, count: int, shape: tuple) -> ndarray:
+    return ndarray((count,) + shape, dtype = uint8, buffer = memory.buf)
+
+# Splits `start` to `end` into at most `parts` runs of about equal length
+def chunks(start: int, end: int, parts: int) -> list[tuple[int, int]]:
+    step = max(1, -(-(end - start) // parts))
+    return [(i, min(end, i + step)) for i in range(start, end, step)]
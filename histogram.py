@@ -0,0 +1,178 @@
+# Counts the colours in arrays of pixels
+
+from __future__ import annotations
+
+from collections import deque
+from itertools import count
+from typing import Iterable, Iterator
+
+from numpy import ndarray, bincount, unique, flatnonzero, empty, concatenate, float64, int64, uint8, uint32
+from numpy.random import default_rng
+
+# The most bits per channel counted with a fixed size table. At 6 bits
+# the table is 2 MB, at 8 it would be 128 MB.
+DENSE_BITS = 6
+
+
+# Counts the colours in an H x W (x 3) array of pixels.
+# Returns an N x 3 array of colours and an array of their frequencies.
+#   bits: the bits kept per channel. Below 8, colours are binned
+#       together and each bin is given the mean colour of its pixels.
+#   sample: the most pixels to look at. Larger images are sampled at
+#       random, with a fixed seed, and the counts scaled back up.
+def histogram(pixels: ndarray, bits: int = 8, sample: int = None, seed: int = 0) -> tuple[ndarray, ndarray]:
+
+    # Grey pixels become triples
+    if pixels.ndim == 2:
+        pixels = pixels[..., None].repeat(3, axis = 2)
+
+    pixels = pixels.reshape(-1, 3)
+    total = len(pixels)
+
+    # Samples the pixels
+    if sample and total > sample:
+        pixels = pixels[default_rng(seed).integers(0, total, sample)]
+
+    keys = pack_bins(pixels, bits)
+    bins = 2 ** (3 * bits)
+
+    # Counts with a fixed size table when it is small, and no bigger
+    # than a few times the pixels, otherwise by sorting. Either way,
+    # `labels` gives each pixel's row in `counts` and `present` picks
+    # out the rows that have any pixels.
+    if bits <= DENSE_BITS and bins <= 4 * len(keys):
+        labels = keys
+        counts = bincount(labels, minlength = bins)
+        present = keys = flatnonzero(counts)
+    else:
+        keys, labels = unique(keys, return_inverse = True)
+        counts = bincount(labels)
+        present = slice(None)
+
+    # Finds the colours themselves. Binned colours are the mean of
+    # their pixels.
+    if bits == 8:
+        colours = unpack_bins(keys)
+    else:
+        colours = empty((len(keys), 3), dtype = uint8)
+        for channel in range(3):
+            sums = bincount(labels, weights = pixels[:, channel], minlength = len(counts))
+            colours[:, channel] = (sums[present] / counts[present]).round()
+
+    counts = counts[present]
+
+    # Scales sampled counts back up to the whole image
+    if len(pixels) < total:
+        counts = (counts * (total / len(pixels))).round()
+
+    return colours, counts.astype(int64)
+
+
+# Adds histograms together, giving each colour once with its total
+# frequency, in the same order as histogram
+def merge(histograms: list[tuple[ndarray, ndarray]]) -> tuple[ndarray, ndarray]:
+    keys, labels = unique(concatenate([pack_bins(colours) for colours, counts in histograms]), return_inverse = True)
+    counts = bincount(labels, weights = concatenate([counts for colours, counts in histograms]))
+    return unpack_bins(keys), counts.round().astype(int64)
+
+
+# Sums each histogram with those of its neighbours, each weighted by
+# alpha ** distance, looking back as far as `behind` and ahead as far
+# as `ahead`. Yields the sums in order, reading no more than `ahead`
+# histograms past the one being summed, and rounds them to whole counts.
+#
+# The sum behind is carried forward from step to step: scaled by
+# alpha, with the newest added and the furthest dropped. The sum ahead
+# would have to be divided by alpha to do the same, which compounds
+# rounding errors, so it is carried only for `ahead` steps at a time
+# and then summed afresh. Either way, each step costs a few merges
+# rather than one per neighbour.
+def sliding_histograms(histograms: Iterable[tuple[ndarray, ndarray]], alpha: float,
+                       behind: int, ahead: int) -> Iterator[tuple[ndarray, ndarray]]:
+    source = iter(histograms)
+
+    # The histograms from `first` on, as packed keys and counts
+    window = deque()
+    first = 0
+
+    nothing = (empty(0, dtype = uint32), empty(0, dtype = float64))
+    left = right = nothing
+
+    # Any colour that is really there counts at least this much
+    least = alpha ** max(behind, ahead) / 2
+
+    for i in count():
+
+        # Reads ahead
+        while first + len(window) <= i + ahead:
+            histogram = next(source, None)
+            if histogram is None:
+                break
+            window.append((pack_bins(histogram[0]), histogram[1].astype(float64)))
+        if i >= first + len(window):
+            return
+
+        # The histogram `d` away from the current one, if held
+        def at(d: int) -> tuple[ndarray, ndarray]:
+            return window[i + d - first] if 0 <= i + d - first < len(window) else nothing
+
+        if i > 0:
+            left = weighted_sum([(left, alpha), (at(-1), alpha), (at(-1 - behind), -alpha ** (behind + 1))], least)
+
+            # Drops the histogram the sum behind no longer needs
+            if i - behind > first:
+                window.popleft()
+                first += 1
+
+        if ahead and i % ahead:
+            right = weighted_sum([(right, 1 / alpha), (at(0), -1), (at(ahead), alpha ** ahead)], least)
+        else:
+            right = weighted_sum([(at(d), alpha ** d) for d in range(1, ahead + 1)], least)
+
+        keys, counts = weighted_sum([(at(0), 1), (left, 1), (right, 1)], least)
+        counts = counts.round()
+        keep = counts > 0
+
+        yield unpack_bins(keys[keep]), counts[keep].astype(int64)
+
+# Adds up histograms held as packed keys and counts, each times its
+# weight, dropping colours whose count is below `least`
+def weighted_sum(terms: list[tuple[tuple[ndarray, ndarray], float]], least: float) -> tuple[ndarray, ndarray]:
+    if not terms:
+        return empty(0, dtype = uint32), empty(0, dtype = float64)
+
+    keys, labels = unique(concatenate([keys for (keys, counts), weight in terms]), return_inverse = True)
+    counts = bincount(labels, weights = concatenate([counts * weight for (keys, counts), weight in terms]), minlength = len(keys))
+
+    keep = counts >= least
+    return keys[keep], counts[keep]
+
+
+# Merges colours that share their top `bits` bits in every channel,
+# giving the weighted mean colour and total weight of each cell
+def coarsen(colours: ndarray, weights: ndarray, bits: int = 5) -> tuple[ndarray, ndarray]:
+    return group_means(colours, weights, unique(pack_bins(colours, bits), return_inverse = True)[1])
+
+# The weighted mean colour and total weight of each group, where
+# `labels` numbers the groups from 0
+def group_means(colours: ndarray, weights: ndarray, labels: ndarray) -> tuple[ndarray, ndarray]:
+    totals = bincount(labels, weights = weights)
+    means = empty((len(totals), 3), dtype = float64)
+    for channel in range(3):
+        means[:, channel] = bincount(labels, weights = weights * colours[:, channel], minlength = len(totals)) / totals
+
+    return means, totals
+
+
+# Packs the top `bits` bits of each channel into one key
+def pack_bins(colours: ndarray, bits: int = 8) -> ndarray:
+    cells = colours.astype(uint32) >> (8 - bits)
+    return (cells[:, 0] << (2 * bits)) | (cells[:, 1] << bits) | cells[:, 2]
+
+# Reverses pack_bins, giving the lowest colour in each cell
+def unpack_bins(keys: ndarray, bits: int = 8) -> ndarray:
+    mask = 2 ** bits - 1
+    colours = empty((len(keys), 3), dtype = uint8)
+    for channel in range(3):
+        colours[:, channel] = ((keys >> ((2 - channel) * bits)) & mask) << (8 - bits)
+    return colours
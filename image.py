@@ -7,38 +7,132 @@ import PIL.ImageChops as Pic
 from PIL.ImageFilter import BLUR, SMOOTH, SMOOTH_MORE, SHARPEN, UnsharpMask, FIND_EDGES
 from PIL.Image import NEAREST as N
 from PIL.Image import LANCZOS as L
+from math import ceil
+from numpy import ndarray, asarray, ascontiguousarray
 from colour import ColourList
 from palette import *
+from kernels import denoise_array, resize_nearest, strips, run_strips, WINDOW_BUDGET, RESIZE_BUDGET
+from lut import MAP_BUDGET
+from histogram import histogram
 
 NEAREST = 'n'
 LANCZOS = 'l'
 
+VECTORISED  = 'v'
+REFERENCE   = 'r'
+
+
+# Counts the bytes of pixels copied or converted between images, to
+# see how much sharing buffers saves
+class CopyCounter:
+    def __init__(self) -> None:
+        self.bytes = 0
+
+    def count(self, source: Pim.Image) -> None:
+        self.bytes += source.width * source.height * len(source.getbands())
+
+    def reset(self) -> None:
+        self.bytes = 0
+
+# Globally accessible
+copy_counter = CopyCounter()
+
+
 class Image:
-    def __init__(self, file: str, location: str = 'inputs', mode: str = 'RGB', source: Pim.Image = None) -> None:
+    # Images read from a file are opened lazily: the size comes from
+    # the file's header, and the pixels are only decoded when first
+    # used. With `draft`, resizing a JPEG read from a file decodes it
+    # afresh at a reduced scale, which is much quicker for large photos,
+    # though the pixels differ slightly from a full decode. This is done
+    # even once the full image is decoded, so the result is the same.
+    #
+    # The pixels are held as a PIL image, `source`, an H x W (x C) array
+    # of bytes, `array`, or both. Whichever is missing is made from the
+    # other when first asked for, so NumPy kernels can be chained
+    # without going through PIL each time.
+    #
+    # Images are never changed in place: every operation gives a new
+    # Image. So copies share pixels freely, and an array given as
+    # `pixels` is kept as a read-only view of the caller's buffer.
+    def __init__(self, file: str, location: str = 'inputs', mode: str = 'RGB', source: Pim.Image = None,
+                 draft: bool = True, pixels: ndarray = None) -> None:
         self.set_file(file, location)
 
         self.mode   = mode
+        self.draft  = draft
 
-        if not source:
-            self.source = self.read()
-        else:
-            self.source = source.convert(self.mode)
-            
+        self.decoded = None
+        self.pixels  = None if pixels is None else read_only(pixels)
+        self.format  = None
 
-        self.width  = self.source.width
-        self.height = self.source.height
-        self.size   = self.source.size
+        if source is not None:
+            self.decoded = source if source.mode == mode else self.converted(source, mode)
+            self.size = self.decoded.size
+        elif pixels is not None:
+            self.size = (pixels.shape[1], pixels.shape[0])
+        else:
+            with self.open() as header:
+                self.format = header.format
+                self.size = header.size
+
+        self.width, self.height = self.size
+
+        # Palettes already counted, by histogram arguments
+        self.palettes: dict[tuple, Palette] = {}
+
+    # Makes an Image that holds an array of pixels as it is
+    @classmethod
+    def from_array(cls, pixels: ndarray, file: str, location: str = 'inputs', mode: str = 'RGB') -> Image:
+        return cls(file, location, mode, pixels = pixels)
+
+    # The pixels as a PIL image, decoded or made from the array on
+    # first use. PIL shares single channel arrays, but has to copy
+    # anything with three channels into its own layout.
+    @property
+    def source(self) -> Pim.Image:
+        if self.decoded is None and self.pixels is not None:
+            pixels = ascontiguousarray(self.pixels)
+            self.decoded = Pim.frombuffer(self.mode, self.size, pixels, 'raw', self.mode, 0, 1)
+            if pixels.ndim == 3:
+                copy_counter.count(self.decoded)
+        elif self.decoded is None:
+            self.decoded = self.read()
+        return self.decoded
+
+    # The pixels as an H x W (x C) array of bytes, made on first use
+    @property
+    def array(self) -> ndarray:
+        if self.pixels is None:
+            self.pixels = asarray(self.source)
+            copy_counter.count(self.source)
+        return self.pixels
+
+    # Opens the file, reading only its header
+    def open(self) -> Pim.Image:
+        return Pim.open(f'{self.location}/{self.file}')
 
     # Reads an Pim.Image
-    def read(self) -> Pim.Image:
+    def read(self, size: tuple = None) -> Pim.Image:
+
+        source = self.open()
+
+        # Decodes at a reduced scale, no smaller than `size`.
+        # Only some formats, such as JPEG, can do this.
+        if size:
+            source.draft('RGB' if self.mode == 'HSV' else self.mode, size)
 
-        source = Pim.open(f'{self.location}/{self.file}',)
-        
         # Ensures the image is in the right mode
         if self.mode != source.mode:
             source = source.convert(self.mode)
 
         return source
+
+    # Whether resizing to `size` can decode straight to a smaller image
+    def draftable(self, size: tuple) -> bool:
+        return (
+            self.draft and self.format == 'JPEG'
+            and size[0] <= self.width // 2 and size[1] <= self.height // 2
+        )
     
     # Saves an image
     def save(self, file_name: str = None, location: str = 'outputs', extension: str = 'png') -> None:
@@ -57,85 +151,143 @@ class Image:
     def show(self, title: str = None) -> None:
         self.source.show(title)
 
-    # Makes a deep copy of this Image
-    def copy(self, source: Pim.Image = None) -> Image:
-        if not source:
-            source = self.source.copy()
-        
+    # Makes a copy of this Image, or a new Image with the given source
+    # or array of pixels. A copy shares this image's pixels.
+    def copy(self, source: Pim.Image = None, pixels: ndarray = None) -> Image:
+        if source is None and pixels is None:
+            source, pixels = self.decoded, self.pixels
+            if source is None and pixels is None:
+                source = self.source
+
         return Image(
             self.file,
             self.location,
             self.mode,
-            source
+            source,
+            pixels = pixels
         )
 
-    # Converts image to a mode
+    # Converts image to a mode. Converting to the same mode just
+    # shares the pixels.
     def convert(self, mode: str) -> Image:
+        if mode == self.mode:
+            return self.copy()
+
         return Image(
             self.file,
             self.location,
             mode,
-            self.source.convert(mode)
+            self.converted(self.source, mode)
         )
+
+    # Converts a PIL image to a mode, counting the bytes
+    def converted(self, source: Pim.Image, mode: str) -> Pim.Image:
+        source = source.convert(mode)
+        copy_counter.count(source)
+        return source
     
     
     # Resizes image.
     # Method can be:
     #   'n': Nearest neighbour
     #   'l': Lanczos/sinc method
-    def resize(self, width: int, method: str = NEAREST) -> Image:
+    # Pixels held only as an array, or resized on several `workers`,
+    # are resized with nearest neighbour without PIL, about `budget`
+    # bytes at a time.
+    def resize(self, width: int, method: str = NEAREST, budget: int = None, workers: int = 1) -> Image:
 
         # Gets the height that preserves aspect ratio
         height = int(width / self.width * self.height)
         size = (width, height)
 
+        if method == NEAREST and (self.decoded is None and self.pixels is not None or workers > 1):
+            return self.copy(pixels = resize_nearest(self.array, size, budget or RESIZE_BUDGET, workers))
+
+        # Large JPEGs that have not been decoded yet start smaller
+        source = self.read(size) if self.draftable(size) else self.source
+
         match method:
             case 'n':
-                return self.copy(self.source.resize(size, resample = N))
+                return self.copy(source.resize(size, resample = N))
             case 'l':
-                return self.copy(self.source.resize(size, resample = L))
+                return self.copy(source.resize(size, resample = L))
             
-    # Conforms the source's colours to a palette
-    def palettise(self, palette: Palette | Pim.Image) -> Image:
+    # Conforms the source's colours to a palette.
+    # A Palette is applied through its lookup table, which also
+    # respects the palette's mode. A PIL palette image is applied
+    # with PIL's quantisation.
+    # A Palette maps about `budget` bytes of pixels at a time, on
+    # `workers` threads.
+    def palettise(self, palette: Palette | Pim.Image, budget: int = None, workers: int = 1) -> Image:
 
         if isinstance(palette, Palette):
-            # Gets the flattened palette
-            colours = list(palette.colours.flatten())
-
-            # Creates an image containing the palette
-            palette_image = Pim.new('P', (len(colours), 1))
-            palette_image.putpalette(colours)
+            # Maps every pixel to its palette colour
+            return self.copy(pixels = palette.lut().map(self.array, budget or MAP_BUDGET, workers))
 
         else:
-            palette_image = palette
-
-        # Quantises the source to the palette
-        source = self.source.quantize(palette = palette_image, dither = 0)
+            # Quantises the source to the palette
+            source = self.source.quantize(palette = palette, dither = 0)
 
         return self.copy(source)
     
-    # Turns the source image into pixel art
-    def pixelate(self, width: int, palette: Palette, denoise: bool = False, *args) -> Image:
-
-        # Constrains the image palette
-        image = self.palettise(palette)
-
-        # Downscales to make it, y'know, pixel art
-        image = image.resize(width, 'n')
+    # Turns the source image into pixel art.
+    # By default the image is downscaled first, so only the pixel art's
+    # own pixels are palettised and nothing full size is made until
+    # the final upscale. Nearest neighbour scaling only picks pixels,
+    # and palettising maps each pixel on its own, so this gives the
+    # same image as palettising first, which `palettise_first` keeps.
+    # With a `budget`, each step works in strips of about that many
+    # bytes, shared between `workers` threads, so at most the input,
+    # the output and `budget` bytes more are held. The upscale can be
+    # written into an `output` array of its shape, such as a memmap.
+    def pixelate(self, width: int, palette: Palette, denoise: bool = False, *args,
+                 palettise_first: bool = False, budget: int = None, workers: int = 1,
+                 output: ndarray = None) -> Image:
+
+        if palettise_first:
+            # Constrains the image palette, then downscales
+            image = self.palettise(palette, budget, workers).resize(width, NEAREST, budget, workers)
+        else:
+            # Downscales, then constrains the image palette
+            image = self.resize(width, NEAREST, budget, workers).palettise(palette, budget, workers)
 
         # Denoises
         if denoise:
-            image = image.denoise(*args)
+            image = image.denoise(*args, budget = budget, workers = workers)
 
         # Upscales to match original resolution
-        image = image.resize(self.width, 'n')
+        if output is not None:
+            size = (self.width, int(self.width / image.width * image.height))
+            shape = (size[1], size[0]) + image.array.shape[2:]
+            if output.shape != shape:
+                raise ValueError(f'Output of shape {output.shape} does not fit the upscaled image, of shape {shape}')
+
+            return image.copy(pixels = resize_nearest(image.array, size, budget or RESIZE_BUDGET, workers, output))
 
-        return image
+        return image.resize(self.width, NEAREST, budget, workers)
     
     # Applies a filter to the image.
     # Image filters are imported from PIL.
-    def filter(self, filter) -> Image:
-        return self.copy(self.source.filter(filter))
+    # With a `budget` or `workers`, filters strips of about that many
+    # bytes, on that many threads. Each strip has enough rows either
+    # side for the filter to match filtering the whole. Filters whose
+    # reach is not known are applied to the whole image.
+    def filter(self, filter, budget: int = None, workers: int = 1) -> Image:
+        margin = filter_margin(filter) if budget or workers > 1 else None
+        if margin is None:
+            return self.copy(self.source.filter(filter))
+
+        source = self.source
+        output = Pim.new(self.mode, self.size)
+        row_bytes = self.width * len(source.getbands())
+
+        def filter_rows(top: int, bottom: int) -> None:
+            start, end = max(0, top - margin), min(self.height, bottom + margin)
+            strip = source.crop((0, start, self.width, end)).filter(filter)
+            output.paste(strip.crop((0, top - start, self.width, bottom - start)), (0, top))
+
+        run_strips(filter_rows, strips(self.height, row_bytes, budget or row_bytes * self.height, workers), workers)
+        return self.copy(output)
     
     # Setters
     def set_file(self, file: str, location: str = 'inputs') -> None:
@@ -145,19 +297,30 @@ class Image:
         
         self.location = location
 
-    # Getters
-    def get_colours(self) -> list:
-        if self.mode == 'L':
-            colours = self.source.getcolors(self.width * self.height)
-            return [(colour[0], [colour[1]] * 3) for colour in colours]
-        
-        return self.source.getcolors(self.width * self.height)
-
-    def colours(self) -> ColourList:
-        return ColourList(self.get_colours(), self.mode)
+    # Getters.
+    # Colours are counted with a NumPy histogram. For large images,
+    #   bits: bins colours, keeping this many bits per channel.
+    #   sample: counts at most this many randomly chosen pixels.
+    def histogram(self, bits: int = 8, sample: int = None) -> tuple[ndarray, ndarray]:
+        return histogram(self.array, bits, sample)
+
+    # Gets the colours as a list of frequency-colour pairs, with colours
+    # as stored, which ColourList and Palette take back as they are
+    def get_colours(self, bits: int = 8, sample: int = None) -> list:
+        colours, frequencies = self.histogram(bits, sample)
+        return list(zip(frequencies.tolist(), map(tuple, colours.tolist())))
+
+    def colours(self, bits: int = 8, sample: int = None) -> ColourList:
+        return ColourList.from_arrays(*self.histogram(bits, sample), self.mode)
     
-    def palette(self) -> Palette:
-        return Palette(self.get_colours(), self.mode)
+    # The palette is counted once per image and arguments. Each call
+    # gives a copy, so changing it leaves the counted one as it was,
+    # but the copies share pre-reductions, so later reductions of any
+    # of them reuse those of the others.
+    def palette(self, bits: int = 8, sample: int = None) -> Palette:
+        if (bits, sample) not in self.palettes:
+            self.palettes[bits, sample] = Palette.from_arrays(*self.histogram(bits, sample), self.mode)
+        return self.palettes[bits, sample].copy()
     
 
     # Denoises a pixel image.
@@ -165,7 +328,24 @@ class Image:
     # its neighbours is less than a threshold, set it to its most
     # dominent neighbour.
     # Threshold is a percent.
-    def denoise(self, threshold: float = 60, radius: int = 2) -> Image:
+    # Method can be:
+    #   'v': Vectorised, working on the whole image at once
+    #   'r': Reference, working pixel-by-pixel
+    def denoise(self, threshold: float = 60, radius: int = 2, method: str = VECTORISED, budget: int = None,
+                workers: int = 1) -> Image:
+        match method:
+            case 'v':   return self.denoise_vectorised(threshold, radius, budget, workers)
+            case 'r':   return self.denoise_reference(threshold, radius)
+            case _:     raise ValueError(f'No such denoise method as "{method}"')
+
+    # Denoises the whole pixel array, in strips of about `budget` bytes
+    # on `workers` threads
+    def denoise_vectorised(self, threshold: float = 60, radius: int = 2, budget: int = None, workers: int = 1) -> Image:
+        return self.copy(pixels = denoise_array(self.array, threshold, radius, budget or WINDOW_BUDGET, workers))
+
+    # The original pixel-by-pixel denoise.
+    # Slow, but kept to check the vectorised method against.
+    def denoise_reference(self, threshold: float = 60, radius: int = 2) -> Image:
 
         # Grabs the pixel map
         pixels = self.source.load()
@@ -207,14 +387,11 @@ class Image:
                     neighbours[colour] = 0
                 neighbours[colour] += 1
 
-        # Reshapes to make ColourList
-        colours = ColourList(
-            [(item[1], item[0]) for item in neighbours.items()], 
-            self.mode
-        )
-
-        # Grabs the most dominent colour
-        dominent = sorted(colours.data, reverse = True, key = lambda c: c[0])[0]
+        # Grabs the most dominent colour as a frequency-colour pair
+        dominent = sorted(
+            [(item[1], item[0]) for item in neighbours.items()],
+            reverse = True, key = lambda c: c[0]
+        )[0]
 
         # Returns the appropriate colour
         if dominent[0] / ((2 * (radius + 1)) ** 2) * 100 <= threshold:
@@ -289,4 +466,31 @@ class Image:
         pixel_art.show()
 
         return pixel_art
-        
\ No newline at end of file
+        
+
+
+# A view of the pixels that cannot be written through
+def read_only(pixels: ndarray) -> ndarray:
+    pixels = pixels.view()
+    pixels.flags.writeable = False
+    return pixels
+
+# How many rows either side of a strip a PIL filter reads, or None if
+# it is not known, as for filters that are not built from a kernel. Blurs are made of three box blurs of about their
+# radius, so reach a little over three times as far.
+def filter_margin(filter) -> int:
+    if isinstance(filter, type):
+        filter = filter()
+
+    if hasattr(filter, 'filterargs'):
+        size = filter.filterargs[0]
+        if isinstance(size, tuple) and all(isinstance(length, int) for length in size):
+            return max(size) // 2
+    elif isinstance(getattr(filter, 'size', None), int):
+        return filter.size // 2
+    elif hasattr(filter, 'radius'):
+        radius = filter.radius if isinstance(filter.radius, tuple) else (filter.radius,)
+        if all(isinstance(length, (int, float)) for length in radius):
+            return 3 * (ceil(max(radius)) + 1)
+
+    return None
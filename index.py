@@ -0,0 +1,107 @@
+# A spatial index for finding the nearest palette colour
+
+from __future__ import annotations
+
+from numpy import ndarray, array, empty, zeros, unique, argsort, append, concatenate, maximum, absolute, arange
+from numpy import float64, int64
+
+from colour import nearest_colours, ordered, LAB_SCALE
+from histogram import pack_bins, unpack_bins
+from kmeans import SEARCH_BUDGET, HSV_SCALE, HSV_TURNS
+
+# Palettes this small are quicker to search directly
+DIRECT_LIMIT = 32
+
+# Stretches each channel so that the difference in each mode becomes
+# a plain squared distance. In HSV the hue also gets copies of every
+# colour a full turn either side, HSV_TURNS, so the shorter way round
+# is found.
+SCALES = {
+    'RGB':  array([1, 1, 1]),
+    'HSV':  HSV_SCALE,
+    'L':    array([1, 0, 0]),
+    'LAB':  1 / LAB_SCALE,
+}
+
+
+class ColourIndex:
+    # Splits the colour cube into cells, `bits` per channel. Each cell
+    # keeps the palette colours that could be nearest to some colour
+    # inside it, so a query only compares against those. Like the LUT,
+    # cells are filled lazily, the first time a colour lands in them.
+    # Answers are exactly those of nearest_colours, ties included.
+    # Colours are given as stored, and measured as `ordered`.
+    def __init__(self, colours: ndarray, mode: str = 'RGB', bits: int = 4) -> None:
+        self.colours    = ordered(colours, mode).astype(int64)
+        self.mode       = mode
+        self.bits       = bits
+
+        points = self.colours
+        if mode == 'HSV':
+            points = concatenate([points + turn for turn in HSV_TURNS])
+
+        # Where each colour sits in the stretched space, and which
+        # palette colour each of those points belongs to
+        self.points     = points * SCALES[mode]
+        self.owners     = arange(len(points)) % max(1, len(colours))
+
+        self.cells      = empty(2 ** (3 * bits), dtype = object)
+        self.filled     = zeros(2 ** (3 * bits), dtype = bool)
+
+    # For each colour, the index of the nearest palette colour and
+    # the difference to it, as nearest_colours
+    def __call__(self, colours: ndarray) -> tuple[ndarray, ndarray]:
+        colours = ordered(colours, self.mode)
+        if len(self.colours) <= DIRECT_LIMIT:
+            return nearest_colours(colours, self.colours, self.mode)
+
+        keys = pack_bins(colours, self.bits)
+        self.fill(unique(keys))
+
+        # Groups the colours by cell
+        order = argsort(keys, kind = 'stable')
+        cells, starts = unique(keys[order], return_index = True)
+        ends = append(starts[1:], len(order))
+
+        indices = empty(len(colours), dtype = int64)
+        differences = empty(len(colours), dtype = float64 if self.mode == 'LAB' else int64)
+
+        for cell, start, end in zip(cells.tolist(), starts.tolist(), ends.tolist()):
+            rows = order[start:end]
+            candidates = self.cells[cell]
+
+            nearest, difference = nearest_colours(colours[rows], self.colours[candidates], self.mode)
+            indices[rows] = candidates[nearest]
+            differences[rows] = difference
+
+        return indices, differences
+
+    # Finds the candidates of any of the given cells not yet filled.
+    # A colour is a candidate if its distance to the nearest corner
+    # of the cell is no more than the smallest distance any colour
+    # has to the cell's furthest corner.
+    def fill(self, keys: ndarray) -> None:
+        keys = keys[~self.filled[keys]]
+        if not len(keys):
+            return
+
+        scale = SCALES[self.mode]
+        lows = unpack_bins(keys, self.bits) * scale
+        highs = (unpack_bins(keys, self.bits) + ((1 << (8 - self.bits)) - 1)) * scale
+
+        step = max(1, SEARCH_BUDGET // len(self.points))
+        for start in range(0, len(keys), step):
+            low = lows[start:start + step, None]
+            high = highs[start:start + step, None]
+
+            near = maximum(low - self.points, 0) + maximum(self.points - high, 0)
+            far = maximum(absolute(self.points - low), absolute(self.points - high))
+            near = (near ** 2).sum(axis = 2)
+            bound = (far ** 2).sum(axis = 2).min(axis = 1)
+
+            # A little slack keeps rounding from dropping a tied colour
+            candidates = near <= bound[:, None] * (1 + 1e-9)
+            for key, row in zip(keys[start:start + step].tolist(), candidates):
+                self.cells[key] = unique(self.owners[row])
+
+        self.filled[keys] = True
@@ -0,0 +1,152 @@
+# Array kernels that work on a whole image at once.
+# These are the NumPy counterparts to the per-pixel loops in Image.
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+
+from numpy import ndarray, empty, full, zeros, stack, take, take_along_axis, where, add, int16, int32, int64, uint8
+
+# Roughly how many bytes of window to hold in memory at once
+WINDOW_BUDGET = 2 ** 25
+
+# Roughly how many bytes of output to resize at once
+RESIZE_BUDGET = 2 ** 24
+
+
+# Packs the channels of each pixel into a single integer key,
+# so that colours can be compared in one operation.
+def pack(pixels: ndarray) -> ndarray:
+    if pixels.ndim == 2:
+        return pixels.astype(int32)
+
+    pixels = pixels.astype(int32)
+    return (pixels[:, :, 0] << 16) | (pixels[:, :, 1] << 8) | pixels[:, :, 2]
+
+# Reverses pack, returning an array of the given number of channels
+def unpack(keys: ndarray, channels: int) -> ndarray:
+    if channels == 1:
+        return keys.astype(uint8)
+
+    return stack([(keys >> 16) & 255, (keys >> 8) & 255, keys & 255], axis = -1).astype(uint8)
+
+
+# Denoises an array of pixels, H x W or H x W x 3.
+# This is a vectorised version of Image.denoise_reference and
+# gives identical output, down to the way ties and the window's
+# edges are handled.
+# Works through the image in strips of rows, so that no more than
+# about `budget` bytes of window are held at once per worker. Each
+# strip is packed with `radius` rows either side, so strips match
+# the whole.
+def denoise_array(pixels: ndarray, threshold: float = 60, radius: int = 2, budget: int = WINDOW_BUDGET,
+                  workers: int = 1) -> ndarray:
+
+    channels = 1 if pixels.ndim == 2 else pixels.shape[2]
+    height, width = pixels.shape[:2]
+    output = empty(pixels.shape, dtype = uint8)
+
+    def denoise_rows(top: int, bottom: int) -> None:
+
+        # Pads the strip's keys so the window never leaves the array.
+        # Padding is marked with -1, which is never a valid colour.
+        start, end = max(0, top - radius), min(height, bottom + radius)
+        padded = full((bottom - top + 2 * radius, width + 2 * radius), -1, dtype = int32)
+        padded[start - top + radius:end - top + radius, radius:radius + width] = pack(pixels[start:end])
+
+        keys = padded[radius:radius + bottom - top, radius:radius + width]
+        output[top:bottom] = unpack(denoise_strip(padded, keys, top, threshold, radius), channels)
+
+    # Each window element is a key and a count
+    span = (2 * radius + 1) ** 2
+    run_strips(denoise_rows, strips(height, span * width * 6, budget, workers), workers)
+
+    return output
+
+# Denoises the rows [top, top + len(keys)) of an image, given the
+# keys of those rows padded by `radius` on every side
+def denoise_strip(padded: ndarray, keys: ndarray, top: int, threshold: float, radius: int) -> ndarray:
+    height, width = keys.shape
+    size = 2 * radius + 1
+
+    # Stacks the neighbourhood of every pixel. The order matches
+    # the reference: x offset in the outer loop, y offset inner.
+    window = empty((size ** 2, height, width), dtype = int32)
+    for i in range(-radius, radius + 1):
+        for j in range(-radius, radius + 1):
+            n = (i + radius) * size + (j + radius)
+            window[n] = padded[radius + j:radius + j + height, radius + i:radius + i + width]
+
+            # The reference skips the neighbour at offset (i, j)
+            # for the pixel at (i, j), so we do the same.
+            if 0 <= i < width and top <= j < top + height:
+                window[n, j - top, i] = -1
+
+    # Counts how often the colour at each position occurs in the window
+    counts = zeros(window.shape, dtype = int16)
+    for p in range(size ** 2):
+        for q in range(p, size ** 2):
+            same = window[p] == window[q]
+            counts[p] += same
+            if p != q:
+                counts[q] += same
+
+    # Positions outside the image don't count
+    counts[window == -1] = 0
+
+    # The first position holding the most frequent colour
+    # wins, which breaks ties the same way as the reference.
+    dominent = counts.argmax(axis = 0)[None]
+    frequency = take_along_axis(counts, dominent, axis = 0)[0]
+    colour = take_along_axis(window, dominent, axis = 0)[0]
+
+    # Only replaces pixels whose dominent neighbour is common enough
+    keep = frequency / ((2 * (radius + 1)) ** 2) * 100 <= threshold
+    return where(keep, keys, colour)
+
+
+# Resizes an array of pixels with nearest neighbour, exactly as PIL
+# does, working through `budget` bytes of output at a time.
+# Writes into `output` if given, which must be the resized shape.
+def resize_nearest(pixels: ndarray, size: tuple, budget: int = RESIZE_BUDGET, workers: int = 1,
+                   output: ndarray = None) -> ndarray:
+    width, height = size
+    rows, columns = nearest_indices(pixels.shape[0], height), nearest_indices(pixels.shape[1], width)
+
+    if output is None:
+        output = empty((height, width) + pixels.shape[2:], dtype = pixels.dtype)
+
+    def resize_rows(top: int, bottom: int) -> None:
+        output[top:bottom] = take(take(pixels, rows[top:bottom], axis = 0), columns, axis = 1)
+
+    run_strips(resize_rows, strips(height, output[0].nbytes, budget, workers), workers)
+    return output
+
+# The source index of each of `count` outputs when `length` inputs are
+# resized. PIL steps through the source by adding the scale each time,
+# so the same rounding comes from accumulating it.
+def nearest_indices(length: int, count: int) -> ndarray:
+    steps = full(count, length / count)
+    steps[0] = length / count * 0.5
+    return add.accumulate(steps).astype(int64)
+
+
+# Splits an image's rows into strips of no more than about `budget`
+# bytes, given how many bytes each row needs, and into at least
+# `parts` strips so that each worker has one
+def strips(height: int, row_bytes: int, budget: int, parts: int = 1) -> list[tuple[int, int]]:
+    rows = max(1, min(budget // max(1, row_bytes), -(-height // max(1, parts))))
+    return [(top, min(height, top + rows)) for top in range(0, height, rows)]
+
+# Runs `function(top, bottom)` over every strip on `workers` threads.
+# Each strip writes only its own rows, so the output is the same
+# whichever order they finish in. NumPy and PIL let go of the GIL
+# for their heavy lifting, so the threads run side by side.
+def run_strips(function, strips: list[tuple[int, int]], workers: int = 1) -> None:
+    if workers <= 1 or len(strips) <= 1:
+        for top, bottom in strips:
+            function(top, bottom)
+        return
+
+    with ThreadPoolExecutor(min(workers, len(strips))) as pool:
+        list(pool.map(lambda strip: function(*strip), strips))
@@ -0,0 +1,164 @@
+# Weighted k-means clustering of a colour histogram
+
+from __future__ import annotations
+
+from numpy import ndarray, array, empty, zeros, concatenate, bincount, cumsum, searchsorted, minimum
+from numpy import sin, cos, arctan2, pi, round, float32, float64, int64
+from numpy.random import default_rng
+
+from histogram import coarsen
+from colour import colour_differences
+
+# Roughly how many pairs of colours, or of colours and cells, to compare
+# at once
+SEARCH_BUDGET = 2 ** 20
+
+# Histograms with more colours than this are clustered coarsely first
+COARSE_LIMIT = 2 ** 15
+
+# Hue differences count double, and wrap around every 255
+HSV_SCALE = array([2, 1, 1])
+HSV_TURNS = [array([turn, 0, 0]) for turn in (0, -255, 255)]
+
+
+# Clusters colours into at most `k` groups, each colour counting
+# as many times as its weight. Works in whichever mode the colours
+# are in; in HSV the hue is treated as circular.
+# Returns the (rounded) centres and the total weight of each.
+#   iterations: the most Lloyd iterations to run.
+#   tolerance: stops once no centre moves further than this.
+#   seed: seeds k-means++, so the same input gives the same output.
+#   centres: starting centres, used instead of k-means++ seeding.
+#       If there are fewer than k, the rest are seeded by k-means++.
+def weighted_kmeans(colours: ndarray, weights: ndarray, k: int, mode: str = 'RGB',
+                    iterations: int = 16, tolerance: float = 0.5, seed: int = 0,
+                    centres: ndarray = None) -> tuple[ndarray, ndarray]:
+
+    colours = colours.astype(float64)
+    weights = weights.astype(float64)
+
+    # Nothing to cluster, wherever the centres would start
+    if len(colours) <= k:
+        return round(colours).astype(int64), weights.astype(int64)
+
+    # Large histograms are clustered on coarser cells first, then
+    # refined with a single pass over every colour
+    search_colours, search_weights = colours, weights
+    if len(colours) > COARSE_LIMIT:
+        search_colours, search_weights = coarsen(colours, weights)
+
+    if centres is None:
+        centres = seed_centres(search_colours, search_weights, k, mode, seed)
+    elif len(centres) < k:
+        centres = seed_centres(search_colours, search_weights, k, mode, seed, centres.astype(float64))
+    else:
+        centres = centres.astype(float64)
+
+    # Lloyd iterations
+    for i in range(iterations):
+        labels = assign(search_colours, centres, mode)
+        moved = update(search_colours, search_weights, labels, centres, mode)
+
+        if moved <= tolerance:
+            break
+
+    if len(colours) > COARSE_LIMIT:
+        update(colours, weights, assign(colours, centres, mode), centres, mode)
+
+    # Totals up the weight of each cluster, dropping empty ones
+    labels = assign(colours, centres, mode)
+    totals = bincount(labels, weights = weights, minlength = len(centres))
+    keep = totals > 0
+
+    return round(centres[keep]).astype(int64), round(totals[keep]).astype(int64)
+
+
+# Picks starting centres with k-means++: each new centre is chosen
+# with probability proportional to weight times squared distance.
+# Starts from the `chosen` centres if given, otherwise from one picked
+# by weight alone.
+def seed_centres(colours: ndarray, weights: ndarray, k: int, mode: str, seed: int, chosen: ndarray = None) -> ndarray:
+    generator = default_rng(seed)
+
+    if chosen is None or not len(chosen):
+        chosen = colours[[pick(weights, generator)]]
+
+    centres = empty((k, colours.shape[1]), dtype = float64)
+    centres[:len(chosen)] = chosen
+
+    closest = colour_differences(colours, centres[0], mode)
+    for centre in centres[1:len(chosen)]:
+        closest = minimum(closest, colour_differences(colours, centre, mode))
+
+    for i in range(len(chosen), k):
+
+        # Every colour is already a centre
+        chances = weights * closest
+        if chances.sum() <= 0:
+            return centres[:i]
+
+        centres[i] = colours[pick(chances, generator)]
+        closest = minimum(closest, colour_differences(colours, centres[i], mode))
+
+    return centres
+
+# Picks an index with probability proportional to its chance
+def pick(chances: ndarray, generator) -> int:
+    total = cumsum(chances)
+    return min(len(total) - 1, int(searchsorted(total, generator.random() * total[-1], side = 'right')))
+
+
+# Index of the nearest centre to each colour.
+# The squared distance is |colour|^2 - 2 colour.centre + |centre|^2,
+# and since the first term is the same for every centre the search
+# becomes a matrix product. In HSV the circular hue is handled by
+# also comparing against copies of the centres a full turn away.
+def assign(colours: ndarray, centres: ndarray, mode: str) -> ndarray:
+    k = len(centres)
+
+    if mode == 'HSV':
+        colours = colours * HSV_SCALE
+        centres = concatenate([centres + turn for turn in HSV_TURNS]) * HSV_SCALE
+
+    # Single precision is plenty to tell centres apart, and halves
+    # the memory traffic of the search
+    colours = colours.astype(float32)
+    squares = (centres ** 2).sum(axis = 1).astype(float32)
+    centres = (-2 * centres.T).astype(float32)
+
+    labels = empty(len(colours), dtype = int64)
+
+    # Searches in chunks to bound memory
+    step = max(1, SEARCH_BUDGET // len(squares))
+    for start in range(0, len(colours), step):
+        distances = colours[start:start + step] @ centres
+        distances += squares
+        labels[start:start + step] = distances.argmin(axis = 1) % k
+
+    return labels
+
+# Moves each centre to the weighted mean of its colours.
+# Returns how far the furthest centre moved.
+def update(colours: ndarray, weights: ndarray, labels: ndarray, centres: ndarray, mode: str) -> float:
+    totals = bincount(labels, weights = weights, minlength = len(centres))
+    filled = totals > 0
+
+    means = zeros(centres.shape, dtype = float64)
+    for channel in range(colours.shape[1]):
+        means[:, channel] = bincount(labels, weights = weights * colours[:, channel], minlength = len(centres))
+
+    # Hue is averaged as an angle
+    if mode == 'HSV':
+        angles = colours[:, 0] / 255 * 2 * pi
+        x = bincount(labels, weights = weights * cos(angles), minlength = len(centres))
+        y = bincount(labels, weights = weights * sin(angles), minlength = len(centres))
+        means[:, 0] = (arctan2(y, x) / (2 * pi) * 255) % 255 * totals
+
+    # Empty clusters stay where they are
+    means[filled] /= totals[filled, None]
+    means[~filled] = centres[~filled]
+
+    moved = colour_differences(means, centres, mode).max() ** 0.5
+    centres[:] = means
+
+    return moved
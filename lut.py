@@ -0,0 +1,149 @@
+# A lookup table that maps pixels to their nearest palette colour
+
+from __future__ import annotations
+
+from threading import Lock
+
+from numpy import ndarray, full, zeros, empty, unique, take, arange, where, int16, int32, int64, uint8, uint16
+
+from index import ColourIndex
+from kernels import strips, run_strips
+
+# Roughly how many bytes of pixels to map at once
+MAP_BUDGET = 2 ** 24
+
+# The bytes needed per channel of a pixel while mapping: its key,
+# index and colour
+PIXEL_BYTES = 10
+
+# Cells are kept in cubes of 2 ** BLOCK_BITS cells a side, each made
+# the first time a pixel lands in it
+BLOCK_BITS = 3
+
+
+class PaletteLUT:
+    # Every cell in a `bits` per channel colour cube gets a palette
+    # index. Cells are filled lazily, the first time a pixel lands in
+    # them, so only the colours that actually occur are ever searched.
+    # With 8 bits every cell is a single colour and the lookup is exact.
+    # Searches go through `index`, which is made if not given.
+    #
+    # The cube is split into smaller cubes, or blocks, of cells. A
+    # block is only made once a pixel lands in it, so a palette that
+    # maps a few images holds a few blocks rather than the whole cube.
+    # Keys hold the block in their high bits and the cell in the block
+    # in their low bits.
+    def __init__(self, colours: ndarray, mode: str = 'RGB', bits: int = 8, index: ColourIndex = None) -> None:
+        self.colours    = colours.astype(int64)
+        self.pixels     = colours.astype(uint8)
+        self.mode       = mode
+        self.bits       = bits
+        self.shift      = 8 - bits
+        self.index      = index or ColourIndex(colours, mode)
+
+        # Indices wide enough for every colour in the palette
+        self.dtype      = uint8 if len(colours) <= 2 ** 8 else uint16 if len(colours) <= 2 ** 16 else int64
+        table_dtype     = int16 if len(colours) < 2 ** 15 else int32
+
+        # Each group of cells gets a block number. Block 0 is never
+        # filled, so cells in blocks not yet made read as unsearched.
+        # -1 marks a cell that has not been searched yet.
+        self.block_bits = min(BLOCK_BITS, bits)
+        self.blocks     = zeros(2 ** (3 * (bits - self.block_bits)), dtype = int32)
+        self.table      = full((2, 2 ** (3 * self.block_bits)), -1, dtype = table_dtype)
+        self.used       = 1
+
+        # Held while cells are searched or blocks made
+        self.lock       = Lock()
+
+    # Maps an H x W (x 3) array of pixels to palette indices
+    def __call__(self, pixels: ndarray) -> ndarray:
+        keys = self.keys(pixels)
+        indices = self.lookup(keys)
+
+        # Searches the cells that have not been seen before
+        missing = indices < 0
+        if missing.any():
+            with self.lock:
+                self.fill(unique(keys[missing]))
+                indices = self.lookup(keys)
+
+        return indices.astype(self.dtype)
+
+    # The index in each cell, or -1 if it is yet to be searched.
+    # Another thread may be making blocks at the same time, so a block
+    # too new for the table read here counts as unsearched.
+    def lookup(self, keys: ndarray) -> ndarray:
+        table = self.table
+        blocks = self.blocks[keys >> (3 * self.block_bits)]
+        blocks = where(blocks < len(table), blocks, 0)
+
+        return table[blocks, keys & (table.shape[1] - 1)]
+
+    # Searches the given cells, making any blocks they need
+    def fill(self, cells: ndarray) -> None:
+        high = cells >> (3 * self.block_bits)
+        new = unique(high[self.blocks[high] == 0])
+
+        if len(new):
+            used = self.used + len(new)
+
+            # Grows the table by half again, so that it is rarely copied
+            if used > len(self.table):
+                table = full((max(used, 3 * len(self.table) // 2), self.table.shape[1]), -1, dtype = self.table.dtype)
+                table[:self.used] = self.table[:self.used]
+                self.table = table
+
+            self.blocks[new] = arange(self.used, used)
+            self.used = used
+
+        self.table[self.blocks[high], cells & (self.table.shape[1] - 1)] = self.nearest(self.centres(cells))
+
+    # Maps pixels straight to their palette colours, keeping their shape.
+    # Works through about `budget` bytes of pixels at a time, counting
+    # the keys and indices made along the way, on `workers` threads.
+    # Threads search new cells one at a time, so the output does not
+    # depend on them.
+    def map(self, pixels: ndarray, budget: int = MAP_BUDGET, workers: int = 1) -> ndarray:
+        output = empty(pixels.shape, dtype = uint8)
+
+        def map_rows(top: int, bottom: int) -> None:
+            colours = take(self.pixels, self(pixels[top:bottom]), axis = 0)
+            output[top:bottom] = colours[..., 0] if pixels.ndim == 2 else colours
+
+        run_strips(map_rows, strips(len(pixels), pixels[0].size * PIXEL_BYTES, budget, workers), workers)
+        return output
+
+    # Finds the cell each pixel falls in
+    def keys(self, pixels: ndarray) -> ndarray:
+        pixels = pixels.astype(int32) >> self.shift
+
+        # Single channel pixels are grey, so every channel is the same
+        if pixels.ndim == 2:
+            red = green = blue = pixels
+        else:
+            red, green, blue = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+
+        low, high = self.block_bits, self.bits - self.block_bits
+        mask = (1 << low) - 1
+
+        return (
+            ((red >> low) << (2 * high + 3 * low)) | ((green >> low) << (high + 3 * low)) | ((blue >> low) << (3 * low)) |
+            ((red & mask) << (2 * low)) | ((green & mask) << low) | (blue & mask)
+        )
+
+    # The colour at the centre of each cell
+    def centres(self, keys: ndarray) -> ndarray:
+        low, high = self.block_bits, self.bits - self.block_bits
+        half = (1 << self.shift) >> 1
+
+        shifts = arange(2, -1, -1)
+        blocks = ((keys[:, None] >> (3 * low + shifts * high)) & ((1 << high) - 1)) << low
+        cells = (keys[:, None] >> (shifts * low)) & ((1 << low) - 1)
+
+        return ((blocks | cells) << self.shift) + half
+
+    # Index of the nearest palette colour to each of the given colours.
+    # Uses the same distance as colour_difference for the palette's mode.
+    def nearest(self, colours: ndarray) -> ndarray:
+        return self.index(colours)[0]
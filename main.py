@@ -1,6 +1,7 @@
 # A little project to turn images and gifs into pixel art
 
 from image import Image
+from cache import palette_cache
 
 from visualise import show_colour_wheel, show_3d
 
@@ -59,8 +60,9 @@ def process_image():
         mode = mode
     )
 
-    # Gets the palette of the image
-    palette = image.palette().reduce(colours, palette_mode)
+    # Gets the palette of the image, from the cache if it has been
+    # reduced before
+    palette = palette_cache.reduce(image, colours, palette_mode)
 
     # Converts image to pixel art, using the contrained palette
     output = image.pixelate(width, palette)
@@ -82,7 +84,7 @@ def visualise_palette():
     )
 
     # Gets the palette
-    palette = image.palette().reduce(colours, palette_mode)
+    palette = palette_cache.reduce(image, colours, palette_mode)
 
     # Converts image to a palette and the colour distribution
     show_colour_wheel(image, palette)
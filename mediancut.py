@@ -0,0 +1,68 @@
+# Median cut quantisation of a colour histogram
+
+from __future__ import annotations
+
+from numpy import ndarray, empty, arange, cumsum, searchsorted, bincount, round, float64, int64
+
+from histogram import group_means
+
+# The value of each byte
+LEVELS = arange(256, dtype = float64)
+
+
+# Splits the colours into at most `k` boxes, each colour counting as
+# many times as its weight. The box holding the most spread, the
+# weighted squared error along its widest channel, is split at the
+# weighted median of that channel until there are `k` boxes or none
+# can be split. Each box becomes the weighted mean of its colours.
+# Hue is treated as a straight line, not a circle.
+# Returns the (rounded) centres and the total weight of each.
+def weighted_median_cut(colours: ndarray, weights: ndarray, k: int) -> tuple[ndarray, ndarray]:
+    colours = colours.astype(int64)
+    weights = weights.astype(float64)
+
+    # Nothing to cut
+    if len(colours) <= k:
+        return colours, round(weights).astype(int64)
+
+    boxes = [spread(colours, weights, arange(len(colours)))]
+    while len(boxes) < k:
+
+        # Finds the box with the most spread
+        best = max(range(len(boxes)), key = lambda i: boxes[i][0])
+        error, channel, members = boxes[best]
+        if error <= 0:
+            break
+
+        # Splits it at the weighted median. Channels are bytes, so the
+        # median comes from a histogram rather than a sort. The cut is
+        # kept inside the box so that neither half is empty.
+        values = colours[members, channel]
+        totals = cumsum(bincount(values, weights = weights[members], minlength = 256))
+        cut = min(int(searchsorted(totals, totals[-1] / 2)), int(values.max()) - 1)
+        below = values <= max(cut, int(values.min()))
+
+        boxes[best] = spread(colours, weights, members[below])
+        boxes.append(spread(colours, weights, members[~below]))
+
+    # Labels each colour with its box
+    labels = empty(len(colours), dtype = int64)
+    for i, (error, channel, members) in enumerate(boxes):
+        labels[members] = i
+
+    centres, totals = group_means(colours, weights, labels)
+    return round(centres).astype(int64), round(totals).astype(int64)
+
+# The spread of a box: the weighted squared error along its widest
+# channel, that channel, and the box's members as an index array.
+# Each channel's error comes from a histogram of its byte values.
+def spread(colours: ndarray, weights: ndarray, members: ndarray) -> tuple[float, int, ndarray]:
+    mass = weights[members]
+    errors = []
+    for channel in range(colours.shape[1]):
+        counts = bincount(colours[members, channel], weights = mass, minlength = 256)
+        mean = (counts * LEVELS).sum() / counts.sum()
+        errors.append((counts * (LEVELS - mean) ** 2).sum())
+
+    channel = max(range(len(errors)), key = lambda i: errors[i])
+    return float(errors[channel]), channel, members
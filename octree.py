@@ -0,0 +1,58 @@
+# Octree quantisation of a colour histogram
+
+from __future__ import annotations
+
+from numpy import ndarray, arange, unique, argsort, flatnonzero, bincount, round
+from numpy import float64, int64
+
+from histogram import pack_bins, unpack_bins, group_means
+
+
+# Groups the colours into at most `k` leaves of an octree, each colour
+# counting as many times as its weight. Starting from the full 8 bits,
+# every leaf is folded into its parent while that still leaves at
+# least `k` leaves. Then only the lightest are folded, just enough to
+# get down to `k`. Each leaf becomes the weighted mean of its colours.
+# Returns the (rounded) centres and the total weight of each.
+def weighted_octree(colours: ndarray, weights: ndarray, k: int) -> tuple[ndarray, ndarray]:
+    weights = weights.astype(float64)
+
+    # Nothing to fold
+    if len(colours) <= k:
+        return colours.astype(int64), round(weights).astype(int64)
+
+    # Each level is found from the leaves of the level below, which
+    # quickly become far fewer than the colours
+    keys, labels = unique(pack_bins(colours, 8), return_inverse = True)
+    for bits in range(7, -1, -1):
+        keys, parents = unique(pack_bins(unpack_bins(keys, bits + 1), bits), return_inverse = True)
+
+        if len(keys) < k:
+            labels = fold(parents, bincount(labels, weights = weights), k)[labels]
+            break
+
+        labels = parents[labels]
+        if len(keys) == k:
+            break
+
+    centres, totals = group_means(colours, weights, labels)
+    return round(centres).astype(int64), round(totals).astype(int64)
+
+# Folds leaves into their parents, lightest parents first, until
+# there are just `k` leaves. Only as many of a parent's lightest
+# children are folded together as are needed.
+# Returns the new label of each leaf.
+def fold(parents: ndarray, mass: ndarray, k: int) -> ndarray:
+    leaves = arange(len(parents))
+    excess = len(parents) - k
+
+    for parent in argsort(bincount(parents, weights = mass), kind = 'stable').tolist():
+        if excess <= 0:
+            break
+
+        children = flatnonzero(parents == parent)
+        children = children[argsort(mass[children], kind = 'stable')][:excess + 1]
+        leaves[children] = children[0]
+        excess -= len(children) - 1
+
+    return unique(leaves, return_inverse = True)[1]
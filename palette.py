@@ -3,6 +3,13 @@
 from __future__ import annotations
 
 from colour import *
+from lut import PaletteLUT
+from index import ColourIndex
+from kmeans import weighted_kmeans
+from mediancut import weighted_median_cut
+from octree import weighted_octree
+from heapq import heapify, heappush, heappop
+from numpy import triu_indices, arange, lexsort, concatenate, zeros, flatnonzero
 
 import PIL.Image as Pim
 
@@ -11,25 +18,77 @@ KMEANS      = 'k'
 DISSIMILAR  = 'd'
 EXTREMAL    = 'e'
 SIMDIS      = 'sd'
+QUANTISE    = 'q'
+MEDIAN      = 'm'
+OCTREE      = 'o'
+
+# K-means started from a similar palette is already close, so it runs
+# for at most this many iterations
+WARM_ITERATIONS = 4
+
+# When one palette starts from another, this fraction of the other's
+# colours, the least frequent, are seeded afresh
+RESEED = 1 / 4
 
 
 class Palette(ColourList):
-    def __init__(self, image_colours: list, mode: str = 'RGB') -> None:
+    __slots__ = ('lookup', 'grid', 'prereduced')
+
+    def __init__(self, image_colours: list = (), mode: str = 'RGB') -> None:
         super().__init__(image_colours, mode)
-    
+
+    # Drops the lookup table, index and pre-reductions, as they no
+    # longer match the colours
+    def changed(self) -> None:
+        super().changed()
+        self.lookup: PaletteLUT = None
+        self.grid: ColourIndex = None
+        self.prereduced: dict[tuple, Palette] = {}
+
+    # A copy with its own arrays. What is derived from the colours is
+    # shared, and pre-reductions made by either are seen by both, until
+    # one of them changes.
+    def copy(self) -> Palette:
+        palette = super().copy()
+        palette.lookup, palette.grid, palette.prereduced = self.lookup, self.grid, self.prereduced
+        return palette
+
+    # Pickles just the colours, so that sending a palette to another
+    # process does not send its lookup table too
+    def __reduce__(self) -> tuple:
+        return Palette.from_arrays, (self.colours, self.frequencies, self.mode)
+
     # Not that indexing a ColourList gives a frequency-colour pair,
     # indexing a Palette only yields colour.
     def __getitem__(self, index: int) -> tuple:
-        return tuple(self.colours[index])
-
-    # Adds item to the palette, albeit inefficiently
-    def add(self, colour: tuple) -> Palette:
-        return Palette(super().add(colour).data, self.mode)
-    
-    # Overloads super class's convert, albeit inefficiently
-    def convert(self, mode: str) -> Palette:
-        return Palette(super().convert(mode).data, mode)
+        if isinstance(index, (slice, ndarray)):
+            return super().__getitem__(index)
+        return tuple(self.colours[index].tolist())
     
+    # Gets the lookup table that maps pixels onto this palette.
+    # It is built once and reused, so palettising many images
+    # with the same palette only searches each colour once.
+    def lut(self) -> PaletteLUT:
+        if not self.lookup:
+            self.lookup = PaletteLUT(self.colours, self.mode, index = self.index())
+        return self.lookup
+
+    # Gets the spatial index of this palette's colours, built once and
+    # reused until the palette changes
+    def index(self) -> ColourIndex:
+        if not self.grid:
+            self.grid = ColourIndex(self.colours, self.mode)
+        return self.grid
+
+    # Given a tuple of colour, returns the most similar in the palette.
+    # Unlike a ColourList, this measures in the palette's own mode.
+    def similar(self, colour: tuple) -> tuple:
+        return self[int(self.index()(array([colour]))[0][0])]
+
+    # Returns a dissimilarity score of the colour to the palette
+    def similarity(self, colour: tuple) -> float:
+        return self.index()(array([colour]))[1][0]
+
     # Paints the palette into a PIL.Image.
     # This paints unfairly, painting one pixel of each
     # colour before repeating, painting a colour no more
@@ -38,8 +97,8 @@ class Palette(ColourList):
         length = int((sum(self.frequencies) / downscale_factor) ** 0.5)
         area = int(length ** 2) # This order is to prevent rounding errors
 
-        # Sorts colours by decreasing occurances
-        data = sorted(self.data, reverse = True, key = lambda c: c[0])
+        # Sorts colours by decreasing occurances, as PIL paints them
+        data = sorted(self.ordered().data, reverse = True, key = lambda c: c[0])
 
         # Creates new PIL image
         image = Pim.new(self.mode, (length, length))
@@ -95,9 +154,10 @@ class Palette(ColourList):
         image = Pim.new(self.mode, (len(self), 1))
         pixels = image.load()
 
-        # Paints the image with the palette
+        # Paints the image with the palette, as PIL paints them
+        colours = self.ordered()
         for i in range(len(self)):
-            pixels[i, 0] = self[i]
+            pixels[i, 0] = colours[i]
 
         # Upscales the image
         if upscale_factor > 1:
@@ -114,18 +174,77 @@ class Palette(ColourList):
     #   's':    combine similar
     #   'd':    build by dissimilar
     #   'e':    n-extremal method
+    #   'sd':   combine similar, then add dissimilar
+    #   'q':    PIL's quantisation of a painted palette
+    #   'm':    median cut
+    #   'o':    octree
     def reduce(self, size: int = 8, mode: str = SIMILAR, *args) -> Palette:
         match mode:
-            case 'k':   return self.reduce_kmeans(size)
+            case 'k':   return self.reduce_kmeans(size, *args)
             case 's':   return self.reduce_similar(size)
             case 'd':   return self.reduce_dissimilar(size)
             case 'e':   return self.reduce_extremal(size, *args)
             case 'sd':  return self.reduce_similar_dissimilar(size, *args)
+            case 'q':   return self.reduce_quantise(size)
+            case 'm':   return self.reduce_median_cut(size)
+            case 'o':   return self.reduce_octree(size)
             case _:     raise ValueError(f'No such palette mode as "{mode}"')
 
+    # The palette reduced to `size` colours by k-means, the stage that
+    # the similar, dissimilar and extremal reductions start from.
+    # Each size and seed is kept until the palette changes, so trying
+    # several modes or sizes on one palette only clusters once.
+    # A new one can `start` from another palette, as reduce_kmeans.
+    def prereduce(self, size: int = 256, seed: int = 0, start: Palette = None) -> Palette:
+        key = (size, seed)
+        if key not in self.prereduced:
+            self.prereduced[key] = self.reduce_kmeans(size, seed, start)
+        return self.prereduced[key]
+
     # Uses k-means clustering to build the palette.
-    # Uses PIL's quantisation to do it quickly.
-    def reduce_kmeans(self, size: int) -> Palette:
+    # Clusters the colours directly, each weighted by its frequency,
+    # and works in the palette's own mode.
+    # Given a `start`, such as the palette of a similar image, the
+    # clusters begin at its colours rather than being seeded, so they
+    # settle in fewer iterations and onto much the same colours. Its
+    # least frequent colours are seeded afresh instead, so that colours
+    # new to this palette still get clusters.
+    def reduce_kmeans(self, size: int, seed: int = 0, start: Palette = None) -> Palette:
+        if start is None:
+            centres, iterations = None, 16
+        else:
+            centres = start.by_frequency(reverse = True).colours[:len(start) - int(len(start) * RESEED)]
+            iterations = WARM_ITERATIONS
+
+        centres, frequencies = weighted_kmeans(
+            ordered(self.colours, self.mode),
+            self.frequencies,
+            size,
+            self.mode,
+            iterations,
+            seed = seed,
+            centres = None if centres is None else ordered(centres, self.mode)
+        )
+
+        # Builds new Palette
+        return Palette.from_arrays(ordered(centres, self.mode), frequencies, self.mode)
+
+    # Uses median cut to build the palette.
+    # Much quicker than k-means for large palettes, but a little rougher.
+    def reduce_median_cut(self, size: int) -> Palette:
+        centres, frequencies = weighted_median_cut(ordered(self.colours, self.mode), self.frequencies, size)
+        return Palette.from_arrays(ordered(centres, self.mode), frequencies, self.mode)
+
+    # Uses an octree to build the palette.
+    # The quickest reduction, though the roughest.
+    def reduce_octree(self, size: int) -> Palette:
+        centres, frequencies = weighted_octree(ordered(self.colours, self.mode), self.frequencies, size)
+        return Palette.from_arrays(ordered(centres, self.mode), frequencies, self.mode)
+
+    # Uses PIL's quantisation to build the palette.
+    # This was the original k-means, and needs the palette to be
+    # painted into an image first.
+    def reduce_quantise(self, size: int) -> Palette:
         
         # Paints an image of the palette so PIL's native
         # k-mean clustering can be used.
@@ -142,76 +261,111 @@ class Palette(ColourList):
         if image.mode != self.mode:
             image = image.convert(self.mode)
 
-        # Builds new Palette
-        return Palette(image.getcolors(image.width * image.height), self.mode)
+        # Builds new Palette, from PIL's pairs, see `ordered`
+        return Palette(image.getcolors(image.width * image.height), self.mode).ordered()
     
     # Takes the top n colours (256 by default) found by k-means and
     # reduces it down by combining the most similar colours.
+    # Pair differences are kept in a heap, so each merge only has
+    # to find the differences to the newly merged colour.
     def reduce_similar(self, size: int) -> Palette:
         
         # Speeds up the process but first reducing to a smaller
         # palette that still is representative
-        palette = self.reduce_kmeans(256)
+        palette = self.prereduce()
 
         # Gets a copy of the colours, sorted by ascending frequency.
         # Although the order does not matter much.
-        data = sorted(palette.data, key = lambda c: c[0])
+        # Merged colours are appended, so a colour's index doubles as
+        # its position in the list and ties are broken in the same way
+        # as a scan over every pair.
+        colours = palette.by_frequency()
+        alive = zeros(2 * len(colours), dtype = bool)
+        alive[:len(colours)] = True
 
-        # Iteratively reduces the palette
-        while len(data) > size:
-
-            # Finds the most similar pair
-            x, y = -1, -1
-            mini = 1e9 # A really big number
-            for i in range(len(data) - 1):
-                for j in range(i + 1, len(data)):
-
-                    diff = colour_difference(data[i], data[j], self.mode)
+        # Finds the difference between every pair
+        points = ordered(colours.colours, self.mode)
+        differences = distance_matrix(points, points, self.mode)
+        x, y = triu_indices(len(colours), 1)
 
-                    # If this pair of colours is more similar
-                    # than the last pair, update
-                    if diff < mini:
-                        mini = diff
-                        x, y = i, j
+        heap = list(zip(differences[x, y].tolist(), x.tolist(), y.tolist()))
+        heapify(heap)
 
-            # Averages the colour and adds it back to the palette.
-            # Notice y is popped first sice y > x.
-            data.append(average_colour(
-                    ColourList([data.pop(y), data.pop(x)], self.mode)
-            ))
-
-        return Palette(data, mode = self.mode)
+        # Iteratively reduces the palette
+        remaining = len(colours)
+        while remaining > size:
+
+            # Finds the most similar pair that has not been merged away
+            diff, x, y = heappop(heap)
+            if not alive[x] or not alive[y]:
+                continue
+
+            # Averages the colour and adds it back to the palette
+            alive[x] = alive[y] = False
+            colours.append(average_colour(colours[array([y, x])]))
+            alive[len(colours) - 1] = True
+            remaining -= 1
+
+            # Adds the differences to the new colour
+            others = flatnonzero(alive[:len(colours) - 1])
+            points = ordered(colours.colours, self.mode)
+            differences = colour_differences(points[others], points[-1], self.mode)
+            for diff, i in zip(differences.tolist(), others.tolist()):
+                heappush(heap, (diff, i, len(colours) - 1))
+
+        return colours[flatnonzero(alive)]
     
+    # Grows the palette up to `size` colours by repeatedly adding the
+    # colour from `colours` least similar to it.
+    # This is farthest-point sampling: each candidate's similarity is
+    # kept in an array and only compared against the newest colour.
+    def extend_dissimilar(self, colours: ColourList, size: int) -> Palette:
+        added = []
+
+        # Nothing left to add
+        if len(colours) > 0 and len(self) < size:
+            points = ordered(colours.colours, self.mode)
+            similarity = colour_differences(points[:, None], ordered(self.colours, self.mode)[None, :], 'RGB').min(axis = 1)
+
+            # Ties are broken by the candidates' order. Each round the
+            # candidates are ordered by similarity, then by their order
+            # from the last round, as repeatedly sorting the list would.
+            rank = arange(len(colours))
+
+            # Iterativey adds the most disimilar colour
+            while len(self) + len(added) < size and similarity.max() >= 0:
+
+                # The last of the least similar colours
+                rank[lexsort((rank, similarity))] = arange(len(colours))
+                i = rank.argmax()
+                added.append(i)
+
+                # Updates the similarity to include the new colour.
+                # Colours already added are marked with -1.
+                similarity = minimum(similarity, colour_differences(points, points[i], 'RGB'))
+                similarity[i] = -1
+
+        added = array(added, dtype = int64)
+        return Palette.from_arrays(
+            concatenate([self.colours, colours.colours[added]]),
+            concatenate([self.frequencies, colours.frequencies[added]]),
+            self.mode
+        )
+
     # Starts with the most dominent colour, then iteratively
     # adds the most didsimilar colour.
     def reduce_dissimilar(self, size: int) -> Palette:
         
         # Speeds up the process but first reducing to a smaller
         # palette that still is representative
-        # NOTE: this is just a list!
-        colours = sorted(self.reduce_kmeans(256).data, key = lambda c: c[0])
+        colours = self.prereduce().by_frequency()
         
         # Creates the base palette with the most dominent colour.
         # Since the list is sorted, the most dominent item is last.
-        palette = [colours.pop()]
-
-        # Converts the palette to a Palette
-        palette = Palette(palette, self.mode)
-
-        
-        # Iterativey adds the most disimilar colour
-        while len(palette) < size:
-
-            # Sorts by disimilarity to the current palette
-            colours = sorted(
-                colours,
-                key = lambda c: palette.similarity(c[1])
-            )
+        palette = colours[-1:]
 
-            # Adds the least similar colour to the palette
-            palette = palette.add(colours.pop())
-        
-        return palette
+        # Adds the most disimilar colours
+        return palette.extend_dissimilar(colours[:-1], size)
     
     # Combines kmeans and dissimilar strategies.
     # Creates a kmeans palette of size `size - extremals`, then
@@ -227,28 +381,13 @@ class Palette(ColourList):
             extremals = min(int(size / 4), 1)
 
         # Gets a reduced colour set
-        colours = sorted(self.reduce_kmeans(256).data, reverse = True, key = lambda c: c[0])
+        colours = self.prereduce().by_frequency(reverse = True)
 
-        # Gets the starting palette, removing the colours from the list
+        # Gets the starting palette, leaving the rest to choose from
         palette = colours[:size - extremals]
-        colours = colours[size - extremals:]
-
-        # Converts the palette to a Palette
-        palette = Palette(palette, self.mode)
-
-        # Iterativey adds the most disimilar colour
-        while len(palette) < size:
 
-            # Sorts by disimilarity to the current palette
-            colours = sorted(
-                colours,
-                key = lambda c: palette.similarity(c[1])
-            )
-
-            # Adds the least similar colour to the palette
-            palette = palette.add(colours.pop())
-        
-        return palette
+        # Adds the most disimilar colours
+        return palette.extend_dissimilar(colours[size - extremals:], size)
     
     # Reduces the palette down to `size - dissimilars` colours, then
     # goes through again and adds `dissimilars` amount of the most
@@ -263,18 +402,39 @@ class Palette(ColourList):
         palette = self.reduce_similar(size - dissimilars)
 
         # Gets a reduced colour set
-        colours = sorted(self.reduce_kmeans(256).data, reverse = True, key = lambda c: c[0])
-
-        # Iterativey adds the most disimilar colour
-        while len(palette) < size:
-
-            # Sorts by disimilarity to the current palette
-            colours = sorted(
-                colours,
-                key = lambda c: palette.similarity(c[1])
-            )
-
-            # Adds the least similar colour to the palette
-            palette = palette.add(colours.pop())
-        
-        return palette
\ No newline at end of file
+        colours = self.prereduce().by_frequency(reverse = True)
+
+        # Adds the most disimilar colours
+        return palette.extend_dissimilar(colours, size)
+
+
+class TemporalReducer:
+    # Reduces a sequence of palettes, such as those of an animation's
+    # frames, each to `size` colours by `mode`. Neighbouring frames
+    # have much the same colours, so each reduction starts from the one
+    # before: k-means, and the pre-reduction that the similar,
+    # dissimilar and extremal modes start from, begin at the previous
+    # frame's colours, as reduce_kmeans. They need only a few
+    # iterations, and land on much the same colours, so palettes
+    # flicker less from frame to frame. Other modes are done afresh.
+    def __init__(self, size: int = 8, mode: str = SIMILAR, *args) -> None:
+        self.size       = size
+        self.mode       = mode
+        self.args       = args
+
+        # The last palette given, and what it was reduced to
+        self.previous: Palette = None
+        self.reduced: Palette = None
+
+    def __call__(self, palette: Palette) -> Palette:
+        if self.previous is not None:
+            for (size, seed), start in self.previous.prereduced.items():
+                palette.prereduce(size, seed, start)
+
+        if self.mode == KMEANS and self.reduced is not None:
+            reduced = palette.reduce_kmeans(self.size, *self.args, start = self.reduced)
+        else:
+            reduced = palette.reduce(self.size, self.mode, *self.args)
+
+        self.previous, self.reduced = palette, reduced
+        return reduced
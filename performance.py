@@ -3,12 +3,18 @@
 from time import time_ns as timer
 
 from performance_tests.test_logarithms import test_logarithms
+from performance_tests.test_denoise import test_denoise
+from performance_tests.test_palettise import test_palettise
+from performance_tests.test_kmeans import test_kmeans
+from performance_tests.test_pixelate import test_pixelate
+from performance_tests.test_convert import test_convert
+from performance_tests.test_animation import test_animation
 
 
 # A list of tests and their names
 #   Order must match!
-performance_functions = [test_logarithms]
-performance_names = ['Logarithms']
+performance_functions = [test_logarithms, test_denoise, test_palettise, test_kmeans, test_pixelate, test_convert, test_animation]
+performance_names = ['Logarithms', 'Denoise', 'Palettise', 'K-means', 'Pixelate', 'Convert', 'Animation']
 
 
 # Runs a trial of tests
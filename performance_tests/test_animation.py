@@ -0,0 +1,113 @@
+# Testing the performance of palettising every frame of an animation
+#   holding every frame, as Animataion does
+#   streaming the frames, holding only those each palette looks at
+
+from random import randint
+from tempfile import TemporaryDirectory
+
+from numpy import asarray, array_equal, roll, uint8
+from numpy.random import default_rng
+import PIL.Image as Pim
+import PIL.ImageSequence as Pis
+
+from animation import Animataion, APPEND, WINDOW
+from image import Image
+from stream import AnimationStream
+
+
+# Returns the arguments and functions for this test case
+def test_animation(trials):
+    check_stream()
+    check_append()
+
+    # Creates a short clip per trial
+    args = [
+        [moving_frames(randint(128, 256), randint(96, 192), randint(8, 24), i), 2 ** randint(3, 6)]
+            for i in range(trials) # Creates a set of arguments per trial
+    ]
+
+    return args, [framewise_eager, framewise_stream], ['Eager', 'Stream'], True
+
+
+# Noise with few colours, sliding a little further each frame
+def moving_frames(width, height, count, seed = 0, mode = 'RGB'):
+    pixels = default_rng(seed).integers(0, 256, (height, width, 3)).astype(uint8)
+    return [
+        Image(f'frame_{i}.png', source = Pim.fromarray(roll(pixels, 3 * i, axis = 1)).quantize(64).convert(mode), mode = mode)
+            for i in range(count)
+    ]
+
+
+# A stream must give the frames the whole animation gives, for each way
+# of counting colours, and save the same gif
+def check_stream():
+    for mode in ('RGB', 'HSV'):
+        frames = moving_frames(48, 32, 9, mode = mode)
+        eager = Animataion('check.gif', 'outputs', mode, frames, 80)
+
+        for colour_mode in (APPEND, WINDOW):
+            for max_distance in (0, 1, 3):
+                for temporal in (False, True):
+                    arguments = (6, 'k', 0.5, max_distance, 1, colour_mode, temporal)
+                    expected = eager.framewise_palettise(*arguments)
+                    streamed = stream_of(frames, mode).framewise_palettise(*arguments[:4], *arguments[5:]).collect()
+                    assert same_frames(expected.frames, streamed.frames), \
+                        f'Streamed {mode} palettes differ, counting by "{colour_mode}" up to {max_distance} away'
+
+        with TemporaryDirectory() as location:
+            eager.framewise_palettise(6, 'k').save('eager', 'gif', location)
+            stream_of(frames, mode).framewise_palettise(6, 'k').save('stream', 'gif', location)
+            assert same_gifs(f'{location}/eager.gif', f'{location}/stream.gif'), f'Streamed {mode} gif differs'
+
+def stream_of(frames, mode):
+    return AnimationStream('check.gif', 'outputs', mode, iter(frames), 80, frames[0].size)
+
+def same_frames(a, b):
+    return len(a) == len(b) and all(array_equal(x.array, y.array) for x, y in zip(a, b))
+
+def same_gifs(a, b):
+    a, b = [[asarray(frame.convert('RGB')) for frame in Pis.Iterator(Pim.open(path))] for path in (a, b)]
+    return len(a) == len(b) and all(array_equal(x, y) for x, y in zip(a, b))
+
+
+# Adding up the histograms of squeezed neighbours must count the same
+# colours as pasting them into a collage did
+def check_append():
+    for mode in ('RGB', 'HSV'):
+        animation = Animataion('check.gif', 'outputs', mode, moving_frames(40, 24, 7, mode = mode), 80)
+
+        for frame in (0, 3, 6):
+            for alpha, max_distance in ((0.5, 3), (0.75, -1), (1, 2), (0, 3), (0.5, 0)):
+                colours, frequencies = animation.histogram_append(frame, alpha, max_distance)
+                counted = sorted(zip(frequencies.tolist(), map(tuple, colours.tolist())))
+                assert counted == collage_colours(animation, frame, alpha, max_distance), \
+                    f'{mode} colours of frame {frame} differ from the collage, with {alpha} up to {max_distance} away'
+
+# The old count, pasting each neighbour squeezed by its distance beside
+# the frame and counting the collage
+def collage_colours(animation, frame, alpha, max_distance):
+    frames = [frame.source for frame in animation.frames]
+    collage = frames[frame].copy()
+
+    if alpha != 0 and max_distance != 0:
+        if max_distance == -1:
+            max_distance = len(frames)
+
+        for i in range(max(0, frame - max_distance), min(len(frames), frame + max_distance)):
+            width = int(frames[frame].width * alpha ** abs(frame - i))
+            if i == frame or width == 0:
+                continue
+
+            step = Pim.new(animation.mode, (collage.width + width, collage.height))
+            step.paste(collage, (0, 0))
+            step.paste(frames[i].resize((width, collage.height)), (collage.width, 0))
+            collage = step
+
+    return sorted(collage.getcolors(collage.width * collage.height))
+
+
+def framewise_eager(frames, colours):
+    return Animataion('trial.gif', 'outputs', 'RGB', frames, 80).framewise_palettise(colours, 'k')
+
+def framewise_stream(frames, colours):
+    return AnimationStream('trial.gif', 'outputs', 'RGB', iter(frames), 80, frames[0].size).framewise_palettise(colours, 'k').collect()
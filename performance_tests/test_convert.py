@@ -0,0 +1,73 @@
+# Testing the performance of converting an image's colours to LAB
+#   PIL's conversion, through colour profiles
+#   the array conversion that palettes use
+
+from random import randint
+
+from numpy import asarray, absolute, int64, uint8
+from numpy.random import default_rng
+import PIL.Image as Pim
+
+from colour import ColourList, convert_colours
+from image import Image
+from palette import Palette
+
+
+# Returns the arguments and functions for this test case
+def test_convert(trials):
+    check_lab()
+    check_pairs()
+
+    # Creates an image of random colours per trial
+    args = [
+        [random_pixels(randint(128, 512), randint(128, 512), i)]
+            for i in range(trials) # Creates a set of arguments per trial
+    ]
+
+    return args, [convert_pil, convert_arrays], ['PIL', 'Arrays'], True
+
+
+def random_pixels(width, height, seed = 0):
+    return default_rng(seed).integers(0, 256, (height, width, 3)).astype(uint8)
+
+
+# Palettes and PIL's LAB images must pack colours the same way, with a
+# and b as two's complement, for palettes to be applied to the images.
+# PIL converts under a D50 white point, where palettes use D65, so the
+# colours themselves differ a little.
+def check_lab():
+    pixels = random_pixels(64, 64)
+    difference = convert_pil(pixels).astype(int64) - convert_arrays(pixels)
+
+    # The signed difference, so that -128 and 127 are next to each other
+    difference = absolute((difference + 128) % 256 - 128).reshape(-1, 3).max(axis = 0)
+    assert (difference <= [8, 16, 16]).all(), f'LAB differs from PIL by up to {difference.tolist()}'
+
+
+# Frequency-colour pairs are given and taken with colours as stored, so
+# LAB lists and palettes read back the colours they were made from.
+# Reducing through PIL's own pairs must also keep them as stored.
+def check_pairs():
+    image = Image('check.png', source = Pim.fromarray(random_pixels(16, 16)).convert('LAB'), mode = 'LAB')
+    pairs = sorted(image.get_colours())
+
+    assert pairs_of(ColourList(pairs, 'LAB')) == pairs, 'LAB pairs change in a colour list'
+    assert pairs_of(ColourList(ColourList(pairs, 'LAB').data, 'LAB')) == pairs, 'LAB pairs do not round trip'
+    assert pairs_of(Palette(pairs, 'LAB')) == pairs, 'LAB pairs change in a palette'
+    assert pairs_of(image.colours()) == pairs, 'LAB colour list differs from its pairs'
+
+    # A few colours quantised into as many come back about the same
+    palette = Palette(pairs[:6], 'LAB')
+    reduced = palette.reduce_quantise(6).colours.astype(int64)
+    distance = absolute(reduced[:, None] - palette.colours[None, :]).max(axis = 2).min(axis = 1)
+    assert (distance <= 8).all(), f'LAB quantised colours are off by up to {distance.max()}'
+
+def pairs_of(colours):
+    return sorted(map(tuple, colours.data.tolist()))
+
+
+def convert_pil(pixels):
+    return asarray(Pim.fromarray(pixels).convert('LAB'))
+
+def convert_arrays(pixels):
+    return convert_colours(pixels, 'RGB', 'LAB')
@@ -0,0 +1,59 @@
+# Testing the performance of the two denoising methods
+#   the original pixel-by-pixel reference
+#   the vectorised, whole-image method
+
+from random import randint, seed
+
+from numpy import asarray, array_equal
+import PIL.Image as Pim
+
+from image import Image
+
+
+# Returns the arguments and functions for this test case
+def test_denoise(trials):
+    check_denoise()
+
+    # Creates a small, noisy piece of pixel art per trial
+    args = [
+        [random_image(randint(32, 128), randint(32, 128))]
+            for i in range(trials) # Creates a set of arguments per trial
+    ]
+
+    return args, [denoise_reference, denoise_vectorised], ['Reference', 'Vectorised'], True
+
+
+# Paints an image from a handful of random colours
+def random_image(width, height):
+    colours = [(randint(0, 255), randint(0, 255), randint(0, 255)) for i in range(4)]
+
+    source = Pim.new('RGB', (width, height))
+    pixels = source.load()
+    for i in range(width):
+        for j in range(height):
+            pixels[i, j] = colours[randint(0, 3)]
+
+    return Image('denoise.png', source = source)
+
+
+# The vectorised method must give exactly the reference's image, edges
+# included, for odd and even radii, and however it is split up
+def check_denoise():
+    seed(0)
+    image = random_image(37, 23)
+
+    for radius in (1, 2, 3, 4):
+        for threshold in (20, 60, 90):
+            reference = asarray(image.denoise(threshold, radius, method = 'r').source)
+
+            for budget, workers in ((None, 1), (512, 1), (512, 3)):
+                vectorised = image.denoise(threshold, radius, method = 'v', budget = budget, workers = workers)
+                assert array_equal(asarray(vectorised.source), reference), \
+                    f'Vectorised denoise differs at radius {radius}, threshold {threshold}, budget {budget}, {workers} workers'
+
+
+def denoise_reference(image):
+    return image.denoise(method = 'r')
+
+def denoise_vectorised(image):
+    return image.denoise(method = 'v')
@@ -0,0 +1,184 @@
+# Testing the performance of the histogram palette reductions
+#   PIL's quantisation of a painted palette
+#   weighted k-means on the colour histogram
+#   median cut and octree, which trade some quality for speed
+
+from os import listdir, utime
+from random import randint
+from tempfile import TemporaryDirectory
+
+from numpy import array
+import PIL.Image as Pim
+
+import cache
+from cache import PaletteCache
+from image import Image
+from colour import ColourList, nearest_colours, average_colour, colour_difference, ordered
+from palette import Palette
+
+
+# Returns the arguments and functions for this test case
+def test_kmeans(trials):
+    check_reductions()
+    check_similar()
+    check_dissimilar()
+    check_cache()
+
+    # Creates a noisy gradient per trial, to give lots of colours
+    args = [
+        [gradient_image(randint(128, 512), randint(128, 512)).palette(), 2 ** randint(3, 8)]
+            for i in range(trials) # Creates a set of arguments per trial
+    ]
+
+    return args, [reduce_quantise, reduce_kmeans, reduce_median_cut, reduce_octree], ['Quantise', 'K-means', 'Median cut', 'Octree'], True
+
+
+# Blends gradients with noise, a little like a photo
+def gradient_image(width, height):
+    channels = [
+        Pim.linear_gradient('L').resize((width, height)),
+        Pim.linear_gradient('L').rotate(90).resize((width, height)),
+        Pim.effect_noise((width, height), randint(16, 64)),
+    ]
+
+    return Image('kmeans.png', source = Pim.merge('RGB', channels))
+
+
+# Every reduction must give `size` colours, the same each time. Those
+# from the histogram account for every pixel, where PIL only counts
+# the pixels it paints. K-means should fit the colours at least as
+# well as PIL, and the quicker methods not much worse.
+def check_reductions():
+    palette = gradient_image(192, 160).palette()
+
+    for size in (8, 64):
+        errors = {}
+        for mode in ('q', 'k', 'm', 'o'):
+            reduced = palette.reduce(size, mode)
+            assert len(reduced) == size, f'Reducing by "{mode}" gave {len(reduced)} colours, not {size}'
+            assert mode == 'q' or reduced.frequencies.sum() == palette.frequencies.sum(), f'Reducing by "{mode}" lost pixels'
+            assert (palette.reduce(size, mode).colours == reduced.colours).all(), f'Reducing by "{mode}" is not repeatable'
+
+            errors[mode] = fit_error(palette, reduced)
+
+        assert errors['k'] <= errors['q'], f'K-means fits worse than quantise, {errors}'
+        assert errors['m'] <= 1.5 * errors['q'] and errors['o'] <= 1.5 * errors['q'], f'Quick reductions fit badly, {errors}'
+
+# The mean squared distance from each pixel to its nearest reduced colour
+def fit_error(palette, reduced):
+    differences = nearest_colours(palette.colours, reduced.colours, 'RGB')[1]
+    return (differences * palette.frequencies).sum() / palette.frequencies.sum()
+
+
+# Merging through a heap must give the palette that scanning every
+# pair gives, with ties going to the first pair in the list. The
+# colours are spaced evenly, so many pairs are tied.
+def check_similar():
+    for mode in ('RGB', 'HSV', 'L'):
+        palette = tied_palette(mode)
+        for size in (1, 5, 12):
+            assert similar_by_scan(palette, size) == sorted(palette.reduce_similar(size).data.tolist()), \
+                f'Merging similar {mode} colours down to {size} differs from a scan'
+
+# Colours on a coarse grid, with hues either side of red, and
+# frequencies that repeat
+def tied_palette(mode):
+    colours = [(r, g, b) for r in (0, 64, 240) for g in (0, 32, 64) for b in (16, 48, 80)]
+    return Palette([(1 + i % 4, colour) for i, colour in enumerate(colours)], mode)
+
+# The old reduction, rescanning every pair for each merge
+def similar_by_scan(palette, size):
+    data = sorted(palette.prereduce().data.tolist(), key = lambda c: c[0])
+
+    while len(data) > size:
+        x, y, mini = -1, -1, 1e9
+        for i in range(len(data) - 1):
+            for j in range(i + 1, len(data)):
+                diff = colour_difference(data[i], data[j], palette.mode)
+                if diff < mini:
+                    x, y, mini = i, j, diff
+
+        data.append(average_colour(ColourList([data.pop(y), data.pop(x)], palette.mode)))
+
+    return sorted(Palette(data, palette.mode).data.tolist())
+
+# Farthest-point sampling must add the colours that sorting the
+# candidates by similarity, and taking the last, adds each time. Ties
+# are kept in the order of the last sort.
+def check_dissimilar():
+    for mode in ('RGB', 'HSV', 'L'):
+        colours = tied_palette(mode).by_frequency(reverse = True)
+        for start, size in ((1, 9), (4, 20), (3, 27)):
+            extended = colours[:start].extend_dissimilar(colours[start:], size)
+            assert dissimilar_by_sorting(colours, start, size) == extended.data.tolist(), \
+                f'Adding dissimilar {mode} colours from {start} up to {size} differs from sorting'
+
+# The old extension, sorting every candidate by its squared distance
+# to the nearest colour so far for each colour added
+def dissimilar_by_sorting(colours, start, size):
+    data = colours.data.tolist()
+    palette, candidates = data[:start], data[start:]
+
+    while len(palette) < size:
+        points = [tuple(ordered(array(colour), colours.mode).tolist()) for _, colour in palette]
+        candidates = sorted(candidates, key = lambda c: min(
+            sum((a - b) ** 2 for a, b in zip(ordered(array(c[1]), colours.mode).tolist(), point)) for point in points
+        ))
+        palette.append(candidates.pop())
+
+    return palette
+
+# A reduction is read back as it was put. Another cache version or other
+# parameters miss it, and once the cache is full the least recently used
+# palettes are removed, but never files the cache did not write.
+def check_cache():
+    image = gradient_image(64, 48)
+
+    with TemporaryDirectory() as location:
+        palettes = PaletteCache(location, limit = 250)
+        key = palettes.key(image, 8, 'k')
+        assert palettes.get(key) is None, 'An empty cache found a palette'
+
+        reduced = palettes.reduce(image, 8, 'k')
+        cached = palettes.get(key)
+        assert (cached.colours == reduced.colours).all() and (cached.frequencies == reduced.frequencies).all(), \
+            'A cached palette reads back differently'
+
+        assert palettes.get(palettes.key(image, 16, 'k')) is None, 'Other parameters found the cached palette'
+        cache.CACHE_VERSION += 1
+        try:
+            assert palettes.get(palettes.key(image, 8, 'k')) is None, 'Another cache version found the cached palette'
+        finally:
+            cache.CACHE_VERSION -= 1
+
+        # Files that are not the cache's own are left alone
+        foreign = ['mine.pal', key + '.gpl']
+        for file in foreign:
+            with open(f'{location}/{file}', 'wb') as f:
+                f.write(bytes(1000))
+
+        # Each palette is about 100 bytes, so two fit. The first is
+        # read after the second is written, so the second goes.
+        second = palettes.key(image, 8, 's')
+        palettes.put(second, reduced)
+        utime(palettes.path(key), (1, 1))
+        utime(palettes.path(second), (2, 2))
+        palettes.get(key)
+        third = palettes.key(image, 8, 'm')
+        palettes.put(third, reduced)
+
+        expected = sorted(foreign + [key + '.pal', third + '.pal'])
+        assert sorted(listdir(location)) == expected, f'The cache kept {sorted(listdir(location))}, not {expected}'
+
+
+def reduce_quantise(palette, size):
+    return palette.reduce(size, 'q')
+
+def reduce_kmeans(palette, size):
+    return palette.reduce(size, 'k')
+
+def reduce_median_cut(palette, size):
+    return palette.reduce(size, 'm')
+
+def reduce_octree(palette, size):
+    return palette.reduce(size, 'o')
@@ -0,0 +1,80 @@
+# Testing the performance of palettising many frames with one palette
+#   PIL's quantisation, which searches every frame again
+#   the palette's lookup table, which is built once and reused
+
+from random import randint
+
+from numpy import array_equal, ones, int64, uint8
+from numpy.random import default_rng
+import PIL.Image as Pim
+
+from image import Image
+from palette import Palette
+from colour import nearest_colours
+
+
+# Returns the arguments and functions for this test case
+def test_palettise(trials):
+    check_palettise()
+    check_large_palette()
+
+    # Every trial palettises the same frames with the same palette,
+    # so the lookup table is only built on the first trial.
+    frames = random_frames(256, 192, 8)
+    palette = frames[0].palette().reduce(16, 'k')
+
+    return [frames, palette], [palettise_quantise, palettise_lut], ['Quantise', 'LUT'], False
+
+
+# Paints an image of random colours, then pans across it.
+# Like a real video, the frames share most of their colours.
+def random_frames(width, height, count):
+    source = Pim.new('RGB', (width + count, height))
+    pixels = source.load()
+    for i in range(width + count):
+        for j in range(height):
+            pixels[i, j] = (randint(0, 255), randint(0, 255), randint(0, 255))
+
+    return [
+        Image('palettise.png', source = source.crop((i, 0, i + width, height)))
+            for i in range(count)
+    ]
+
+
+# Each pixel must get its nearest palette colour, whether the lookup
+# table is new or reused, and however the mapping is split up
+def check_palettise():
+    random = default_rng(0)
+    frames = [random.integers(0, 256, (48, 64, 3)).astype(uint8) for i in range(3)]
+    palette = Palette.from_arrays(random.integers(0, 256, (16, 3)).astype(uint8), ones(16, dtype = int64))
+
+    for budget, workers in ((None, 1), (4096, 1), (4096, 3)):
+        palette.changed()
+        for pixels in frames:
+            check_nearest(pixels, palette, budget, workers)
+
+# A palette of over 256 colours needs wider indices than a byte, so
+# checks that each pixel still gets its nearest colour
+def check_large_palette():
+    random = default_rng(0)
+    palette = Palette.from_arrays(random.integers(0, 256, (300, 3)).astype(uint8), ones(300, dtype = int64))
+    check_nearest(random.integers(0, 256, (50, 50, 3)).astype(uint8), palette)
+
+def check_nearest(pixels, palette, budget = None, workers = 1):
+    nearest = palette.colours[nearest_colours(pixels.reshape(-1, 3), palette.colours, 'RGB')[0]]
+    output = Image.from_array(pixels, 'palettise.png').palettise(palette, budget, workers).array
+
+    assert array_equal(output.reshape(-1, 3), nearest), \
+        f'Palettising with {len(palette)} colours gave the wrong colours, budget {budget}, {workers} workers'
+
+
+def palettise_quantise(frames, palette):
+
+    # Creates an image containing the palette
+    palette_image = Pim.new('P', (len(palette), 1))
+    palette_image.putpalette(list(palette.colours.flatten()))
+
+    return [frame.palettise(palette_image) for frame in frames]
+
+def palettise_lut(frames, palette):
+    return [frame.palettise(palette) for frame in frames]
@@ -0,0 +1,99 @@
+# Testing the performance of the two pixelate orders
+#   palettising the full image, then downscaling
+#   downscaling, then palettising only the pixel art's pixels
+#   palettising first again, in strips shared between every core
+
+from os import cpu_count
+from random import randint
+
+from numpy import array_equal, shares_memory
+from PIL.ImageFilter import Filter, Color3DLUT, BLUR, SHARPEN, EMBOSS, GaussianBlur, UnsharpMask, MedianFilter
+
+from image import Image, copy_counter
+from performance_tests.test_kmeans import gradient_image
+
+
+# Returns the arguments and functions for this test case
+def test_pixelate(trials):
+    check_orders()
+    check_filters()
+    check_copies()
+
+    # Creates a large image and palette per trial
+    args = []
+    for i in range(trials):
+        image = gradient_image(randint(1024, 2048), randint(768, 1536))
+        args.append([image, image.palette().reduce(16, 'k'), 2 ** randint(5, 8)])
+
+    return args, [pixelate_palettise_first, pixelate_downscale_first, pixelate_threaded], ['Palettise first', 'Downscale first', 'Threaded'], True
+
+
+# Both orders, in strips or not, on any number of threads, must give
+# the same image
+def check_orders():
+    image = gradient_image(301, 203)
+    palette = image.palette().reduce(16, 'k')
+
+    for width in (37, 64):
+        for denoise in (False, True):
+            expected = image.pixelate(width, palette, denoise).array
+            for palettise_first in (False, True):
+                for budget, workers in ((None, 1), (4096, 1), (4096, 3)):
+                    pixel_art = image.pixelate(width, palette, denoise, palettise_first = palettise_first, budget = budget, workers = workers)
+                    assert array_equal(pixel_art.array, expected), \
+                        f'Pixelating to {width} differs, palettise first {palettise_first}, budget {budget}, {workers} workers'
+
+# Filtering in strips, on any number of threads, must give the same
+# image as filtering the whole. Filters whose reach is not known, such
+# as a colour lookup or one made from scratch, are filtered whole
+# rather than failing.
+def check_filters():
+    image = gradient_image(301, 203)
+    filters = [
+        BLUR, SHARPEN, GaussianBlur(2), UnsharpMask(), MedianFilter(5),
+        Color3DLUT.generate(5, lambda r, g, b: (b, g, r)), PlainFilter(),
+    ]
+
+    for filter in filters:
+        expected = image.filter(filter).array
+        for budget, workers in ((4096, 1), (None, 3), (4096, 3)):
+            assert array_equal(image.filter(filter, budget, workers).array, expected), \
+                f'Filtering with {filter} differs, budget {budget}, {workers} workers'
+
+# A filter made from scratch, so with nothing to tell how far it reaches
+class PlainFilter(Filter):
+    def filter(self, image):
+        return image.filter(*EMBOSS.filterargs)
+
+# Every step of pixelating pixels held as an array works on arrays, so
+# nothing is copied between PIL and NumPy, and the array given is
+# shared rather than copied, but never written to
+def check_copies():
+    image = gradient_image(256, 192)
+    pixels = image.array.copy()
+    before = pixels.copy()
+    palette = image.palette().reduce(8, 'k')
+
+    image = Image.from_array(pixels, 'pixelate.png')
+    copy_counter.reset()
+    for palettise_first in (False, True):
+        image.pixelate(64, palette, True, palettise_first = palettise_first).array
+
+    assert copy_counter.bytes == 0, f'Pixelating copied {copy_counter.bytes} bytes'
+    assert shares_memory(image.array, pixels) and not image.array.flags.writeable, 'The array given was not shared read-only'
+    assert array_equal(pixels, before), 'The array given was changed'
+
+
+# The palette's lookup table is dropped each time, so that neither
+# order benefits from the other's searches
+def pixelate_palettise_first(image, palette, width):
+    palette.changed()
+    return image.pixelate(width, palette, palettise_first = True)
+
+def pixelate_downscale_first(image, palette, width):
+    palette.changed()
+    return image.pixelate(width, palette)
+
+def pixelate_threaded(image, palette, width):
+    palette.changed()
+    return image.pixelate(width, palette, palettise_first = True, workers = cpu_count())
@@ -0,0 +1,208 @@
+# A streaming analogue to animation.
+# Frames are decoded, processed and encoded one at a time by a chain of
+# generators, so only a handful are ever held in memory at once.
+
+from __future__ import annotations
+
+from typing import Iterable, Iterator
+from itertools import islice, chain, count
+
+from image import Image
+from palette import *
+from animation import Animataion, gif_frames, mp4_frames, mp4_duration, write_mp4, window_histograms
+from animation import NEAREST, APPEND
+import PIL.Image as Pim
+from PIL.GifImagePlugin import getheader, getdata
+import cv2
+
+
+class AnimationStream:
+    # Works like Animataion, except that `frames` is an iterable that
+    # can only be gone through once. Each operation returns a new
+    # stream whose frames are made from this one's as they are asked
+    # for, and nothing is done until the stream is saved or collected.
+    # Each frame comes out the same as in Animataion.
+    def __init__(self, file: str, location: str = 'inputs', mode: str = 'RGB', frames: Iterable[Image] = None,
+                 duration: int = 100, size: tuple[int, int] = None) -> None:
+
+        # Sets path information
+        self.set_file(file, location)
+
+        self.mode = mode
+
+        # Sets the source
+        if frames is None:
+            self.frames, self.duration, self.size = self.read()
+        else:
+            self.frames, self.duration, self.size = frames, duration, size
+
+        self.width, self.height = self.size
+
+    # Opens the file, reading only what is needed to know the size and
+    # duration. Frames are decoded as they are asked for.
+    def read(self) -> tuple[Iterator[Image], int, tuple[int, int]]:
+        match self.file_extension:
+            case 'gif': return self.read_gif()
+            case 'mp4': return self.read_mp4()
+            case _:     raise ValueError(f'Invalid video format "{self.file_extension}"')
+
+    # A gif's duration can only be known frame by frame, so the first
+    # frame's is used, where Animataion uses the last's
+    def read_gif(self) -> tuple[Iterator[Image], int, tuple[int, int]]:
+        gif = Pim.open(f'{self.location}/{self.file}')
+        return gif_frames(gif, self.file_name, self.mode), gif.info.get('duration', 100), gif.size
+
+    def read_mp4(self) -> tuple[Iterator[Image], int, tuple[int, int]]:
+        capture = cv2.VideoCapture(f'{self.location}/{self.file}')
+        size = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+        return mp4_frames(capture, self.file, self.location, self.mode), mp4_duration(capture), size
+
+    # A stream of the same animation with other frames
+    def copy(self, frames: Iterable[Image], mode: str = None, duration: int = None, size: tuple[int, int] = None) -> AnimationStream:
+        return AnimationStream(
+            self.file,
+            self.location,
+            mode or self.mode,
+            frames,
+            duration or self.duration,
+            size or self.size
+        )
+
+    # Reads every remaining frame into an Animataion
+    def collect(self) -> Animataion:
+        return Animataion(self.file, self.location, self.mode, list(self.frames), self.duration)
+
+    # Saves the animation, processing each frame on the way
+    def save(self, file_name: str = None, extension: str = None, location: str = 'outputs') -> None:
+
+        # Sets defaults
+        if not file_name:
+            file_name = self.file_name
+        if not extension:
+            extension = self.file_extension
+
+        match extension:
+            case 'gif': self.save_gif(file_name, location)
+            case 'mp4': self.save_mp4(file_name, location)
+            case _:     raise ValueError(f'Invalid image type to save "{extension}"')
+
+    def save_gif(self, file_name: str = None, location: str = 'outputs') -> None:
+        write_gif(self.frames, f'{location}/{file_name}.gif', self.duration)
+
+    def save_mp4(self, file_name: str = None, location: str = 'outputs') -> None:
+        write_mp4(self.frames, f'{location}/{file_name}.mp4', self.duration, self.size)
+
+    # Setters
+    def set_file(self, file: str, location: str = 'inputs') -> None:
+        self.file = file
+        self.file_name = file[:file.index('.')]
+        self.file_extension = file[file.index('.') + 1:]
+
+        self.location = location
+
+    # Converts image types
+    def convert(self, mode: str) -> AnimationStream:
+        return self.copy((frame.convert(mode) for frame in self.frames), mode)
+
+    # Resizes the animation
+    def resize(self, width: int, method: str = NEAREST) -> AnimationStream:
+        size = (width, int(width / self.width * self.height))
+        return self.copy((frame.resize(width, method) for frame in self.frames), size = size)
+
+    # Applies a filter to each frame
+    def filter(self, filter) -> AnimationStream:
+        return self.copy(frame.filter(filter) for frame in self.frames)
+
+    # Skips frames and increases duration, making for choppier animation
+    def skip(self, step: int) -> AnimationStream:
+        return self.copy(islice(self.frames, 0, None, step), duration = int(self.duration * step))
+
+    # Flattens the colours to those of the first frame, which is read
+    # ahead and then put back at the front of the stream
+    def flatten(self, colours: int = 32) -> AnimationStream:
+        frames = iter(self.frames)
+        first = next(frames)
+
+        palette = first.palette().reduce(min(256, colours), KMEANS)
+        return self.copy(chain([first], frames)).palettise(palette)
+
+    # Applies a palette to every frame
+    def palettise(self, palette: Palette) -> AnimationStream:
+        return self.copy(frame.palettise(palette) for frame in self.frames)
+
+    # Creates a custom palette based on each frame and its neighbours,
+    # as Animataion.framewise_palettise.
+    # Only the frames within `max_distance` of the current one are
+    # held, so looking over every frame (-1) is not possible.
+    def framewise_palettise(self, colours: int, palette_mode: str = DISSIMILAR, alpha: float = 0.5, max_distance = 3,
+                            colour_mode: str = APPEND, temporal: bool = False) -> AnimationStream:
+        if max_distance < 0:
+            raise ValueError('A stream cannot look over every frame, so max_distance must be given')
+
+        match colour_mode:
+            case 'a': counted = self.append_histograms(alpha, max_distance)
+            case 'w': counted = window_histograms(self.frames, self.width, alpha, max_distance)
+            case _:   raise ValueError(f'Invalid colour acquisition mode "{colour_mode}"')
+
+        if temporal:
+            reduce = TemporalReducer(colours, palette_mode)
+        else:
+            reduce = lambda palette: palette.reduce(colours, palette_mode)
+
+        return self.copy(frame.palettise(reduce(Palette.from_arrays(*counts, self.mode))) for frame, counts in counted)
+
+    # Yields each frame along with its colours counted by APPEND
+    def append_histograms(self, alpha: float, max_distance: int) -> Iterator[tuple[Image, tuple[ndarray, ndarray]]]:
+        frames = iter(self.frames)
+
+        # The frames from `start` on that are held
+        window: list[Image] = []
+        start = 0
+
+        for i in count():
+
+            # Reads ahead to the furthest frame the palette looks at
+            window += islice(frames, max(0, i + max(1, max_distance) - start - len(window)))
+            if i >= start + len(window):
+                return
+
+            # Drops the frames now too far behind
+            behind = max(0, i - max_distance) - start
+            del window[:behind]
+            start += behind
+
+            # The window gives the same neighbours as the whole animation
+            # would, as Animataion only looks at frames within max_distance
+            neighbours = Animataion(self.file, self.location, self.mode, window, self.duration)
+            yield window[i - start], neighbours.histogram_append(i - start, alpha, max_distance)
+
+    # Creates pixel art
+    def pixilate(self, width: int, palette: Palette = None) -> AnimationStream:
+
+        stream = self
+
+        # Applies the palette to every frame
+        if palette:
+            stream = stream.palettise(palette)
+
+        # Downsizes, then returns to the original size
+        return stream.resize(width, NEAREST).resize(self.width, NEAREST)
+
+
+# Writes frames to a gif as they come. Each frame is quantised the way
+# PIL does when saving RGB frames, and given its own colour table.
+def write_gif(frames: Iterable[Image], path: str, duration: int, loop: int = 0) -> None:
+    with open(path, 'wb') as f:
+        for i, frame in enumerate(frames):
+            source = frame.source.convert('RGB').convert('P', palette = Pim.Palette.ADAPTIVE)
+
+            # The header is taken from the first frame
+            if i == 0:
+                header, used = getheader(source, info = {'loop': loop})
+                f.write(b''.join(header))
+
+            f.write(b''.join(getdata(source, include_color_table = True, duration = duration)))
+
+        # Trailer
+        f.write(b';')
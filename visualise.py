@@ -8,8 +8,7 @@ import PIL.Image as Pim
 
 from math import sin, cos, pi
 
-from numpy import array
-from colorsys import hsv_to_rgb
+from colour import hsv_to_rgb_unit
 
 # Paints a colour wheel to visualise an image's palette
 def show_colour_wheel(image: Image, palette: Palette) -> None:
@@ -56,7 +55,7 @@ def show_colour_wheel(image: Image, palette: Palette) -> None:
 
 
     # Paints the colours
-    for colour in colours.colours:
+    for colour in colours.colours.tolist():
         h = colour[0]
         s = colour[1]
         v = colour[2]
@@ -102,7 +101,7 @@ def show_3d(image: Image, palette: Palette) -> None:
     colours = colours.colours[::5]
 
     # Converts the colours to an appropriate range of 0-1 (and to RGB)
-    colours_RGB = array([hsv_to_rgb(*(colour / 255)) for colour in colours])
+    colours_RGB = hsv_to_rgb_unit(colours / 255)
     
 
     # Finds the most occuring colour for normalisation
@@ -116,7 +115,7 @@ def show_3d(image: Image, palette: Palette) -> None:
 
     # Maps the colours to an appropriate range and shifts the palette
     # marker colours away form the cooridnate colours to improve visibility
-    palette_RGB = array([hsv_to_rgb(*(colour / 255)) for colour in palette.colours])
+    palette_RGB = hsv_to_rgb_unit(palette.colours / 255)
     
     # Adds an offset to the hue
     palette_RGB[:, 0] += 1 / 3